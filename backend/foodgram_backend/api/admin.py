@@ -1,5 +1,7 @@
 from django.contrib import admin, messages
 from django.core.exceptions import ValidationError
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
 
 from .models import (
     Favorite,
@@ -9,6 +11,8 @@ from .models import (
     ShoppingCart,
     Tag,
 )
+from .constants import DUPLICATE_THRESHOLD
+from .similarity import find_duplicates, find_similar
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -39,14 +43,58 @@ class IngredientAdmin(admin.ModelAdmin):
     search_fields = ('name',)
 
 
+class PossibleDuplicatesFilter(admin.SimpleListFilter):
+    """
+    Рецепты, у которых есть рецепт с почти таким же
+    набором ингредиентов.
+    """
+    title = 'возможные дубликаты'
+    parameter_name = 'duplicates'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Есть похожий рецепт'),)
+
+    def queryset(self, request, queryset):
+        if self.value() != 'yes':
+            return queryset
+        recipe_ids = {
+            recipe_id
+            for first, second, _ in find_duplicates()
+            for recipe_id in (first, second)
+        }
+        return queryset.filter(pk__in=recipe_ids)
+
+
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'author', 'cooking_time')
     search_fields = ('name', 'author__username')
-    list_filter = ('tags',)
+    list_filter = ('tags', PossibleDuplicatesFilter)
     autocomplete_fields = ('tags', 'ingredients')
+    readonly_fields = ('possible_duplicates',)
     inlines = [RecipeIngredientInline]
 
+    @admin.display(description='Возможные дубликаты')
+    def possible_duplicates(self, obj):
+        if obj.pk is None:
+            return '-'
+        scores = dict(find_similar(obj.pk, threshold=DUPLICATE_THRESHOLD))
+        names = Recipe.objects.filter(pk__in=scores).only('name').in_bulk()
+        if not names:
+            return '-'
+        return format_html_join(
+            format_html('<br>'),
+            '<a href="{}">{}</a> ({:.0%})',
+            (
+                (
+                    reverse('admin:api_recipe_change', args=(pk,)),
+                    names[pk].name,
+                    score,
+                )
+                for pk, score in scores.items() if pk in names
+            ),
+        )
+
     def save_formset(self, request, form, formset, change):
         instances = formset.save(commit=False)
         for obj in formset.deleted_objects:
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from foodgram_backend.db_routing import check_connections
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+_executor = None
+
+
+def get_read_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_READ_WORKERS,
+            thread_name_prefix='async-reads',
+        )
+    return _executor
+
+
+def call_and_close(func, *args, **kwargs):
+    """
+    Потоки пула живут долго, и их постоянные соединения проверяются
+    так же, как в потоке запроса: устаревшие по CONN_MAX_AGE
+    и оборванные закрываются до и после вызова.
+    """
+    close_old_connections()
+    check_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_read(func, *args, **kwargs):
+    """
+    Выполняет синхронный код чтения в ограниченном пуле потоков.
+    В Django 3.2 нет асинхронного ORM, поэтому запросы к базе идут
+    в пуле, а цикл событий тем временем обслуживает другие соединения.
+    Размер пула ограничивает и число постоянных соединений с базой.
+    """
+    return await sync_to_async(
+        call_and_close, thread_sensitive=False, executor=get_read_executor()
+    )(func, *args, **kwargs)
+
+
+def render_view(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def async_read_view(view):
+    """
+    Асинхронная обертка представления DRF для ASGI. GET и HEAD
+    выполняются в пуле чтения вместе с рендерингом ответа,
+    остальные методы - как обычное синхронное представление.
+    """
+    write = sync_to_async(view, thread_sensitive=True)
+
+    async def wrapper(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return await run_read(render_view, view, request, *args, **kwargs)
+        return await write(request, *args, **kwargs)
+
+    # csrf_exempt из django превратил бы обертку в синхронную функцию.
+    wrapper.csrf_exempt = True
+    return wrapper
@@ -0,0 +1,260 @@
+import hashlib
+import pickle
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, router
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+
+from foodgram_backend.caches import is_shared_cache
+from users.models import JWTUser
+
+from .constants import (
+    AUTH_CACHE_SIZE,
+    AUTH_CACHE_TTL,
+    AUTH_LOCAL_TTL,
+    AUTH_STATS_FLUSH_EVERY,
+)
+
+AUTH_STATS = ('local', 'shared', 'miss')
+
+
+def get_token_cache_key(key):
+    # Сам токен в ключ не кладем: ключи кеша видны в мониторинге.
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f'auth_token:{digest}'
+
+
+def get_stats_cache_key(name):
+    return f'auth_token_stats:{name}'
+
+
+def get_shared_ttl():
+    """
+    Срок жизни токена в общем кеше. Кеш в памяти процесса не общий:
+    выход и смена пароля сбрасывают его только в своем воркере,
+    поэтому в остальных токен живет не дольше AUTH_LOCAL_TTL.
+    """
+    return AUTH_CACHE_TTL if is_shared_cache() else AUTH_LOCAL_TTL
+
+
+class TokenCache:
+    """
+    Потокобезопасный LRU-кеш token -> пользователь с TTL.
+    Пользователь хранится сериализованным, чтобы каждый запрос
+    получал свой объект и не менял чужой.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class AuthStats:
+    """
+    Счетчики попаданий в кеш токенов. Копятся в процессе
+    и раз в AUTH_STATS_FLUSH_EVERY проверок сбрасываются
+    в общий кеш, где их читает команда auth_cache_stats.
+    """
+    def __init__(self, flush_every):
+        self.flush_every = flush_every
+        self.counts = dict.fromkeys(AUTH_STATS, 0)
+        self.pending = dict.fromkeys(AUTH_STATS, 0)
+        self.lock = Lock()
+
+    def record(self, name):
+        with self.lock:
+            self.counts[name] += 1
+            self.pending[name] += 1
+            if sum(self.pending.values()) < self.flush_every:
+                return
+            pending = self.pending
+            self.pending = dict.fromkeys(AUTH_STATS, 0)
+        for name, value in pending.items():
+            if not value:
+                continue
+            key = get_stats_cache_key(name)
+            if cache.add(key, value, None):
+                continue
+            try:
+                cache.incr(key, value)
+            except ValueError:
+                cache.set(key, value, None)
+
+    def get_shared(self):
+        values = cache.get_many([get_stats_cache_key(n) for n in AUTH_STATS])
+        return {
+            name: values.get(get_stats_cache_key(name), 0)
+            for name in AUTH_STATS
+        }
+
+    def reset_shared(self):
+        cache.delete_many([get_stats_cache_key(n) for n in AUTH_STATS])
+
+
+local_tokens = TokenCache(AUTH_CACHE_SIZE, AUTH_LOCAL_TTL)
+auth_stats = AuthStats(AUTH_STATS_FLUSH_EVERY)
+
+
+def remember_token(key, user):
+    """
+    Кладет токен с пользователем в общий кеш и в кеш процесса.
+    """
+    cache_key = get_token_cache_key(key)
+    data = pickle.dumps(user, pickle.HIGHEST_PROTOCOL)
+    cache.set(cache_key, data, get_shared_ttl())
+    local_tokens.set(cache_key, data)
+
+
+def invalidate_token(key):
+    """
+    Убирает токен из общего кеша и из кеша своего процесса.
+    Другие процессы перестанут его принимать не позже
+    чем через AUTH_LOCAL_TTL секунд (см. get_shared_ttl).
+    """
+    cache_key = get_token_cache_key(key)
+    local_tokens.discard(cache_key)
+    cache.delete(cache_key)
+
+
+def invalidate_user_tokens(user_id):
+    for key in Token.objects.filter(user_id=user_id).values_list(
+        'key', flat=True
+    ):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса к базе на каждый вызов:
+    пользователь ищется сначала в LRU процесса, затем в общем кеше.
+    Кеш сбрасывается сигналами при удалении токена (выход)
+    и при сохранении пользователя (смена пароля, деактивация).
+    Изменяющие запросы читают пользователя из базы: копия из кеша
+    может устареть, и ее сохранение затерло бы свежие данные.
+    Токен, которого еще нет на реплике, ищется в основной базе,
+    если он создан не раньше REPLICA_PIN_SECONDS назад.
+    """
+    def authenticate(self, request):
+        self.safe = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        if not self.safe:
+            return super().authenticate_credentials(key)
+        cache_key = get_token_cache_key(key)
+        data = local_tokens.get(cache_key)
+        if data is not None:
+            auth_stats.record('local')
+        else:
+            data = cache.get(cache_key)
+            if data is not None:
+                auth_stats.record('shared')
+                local_tokens.set(cache_key, data)
+        if data is None:
+            auth_stats.record('miss')
+            try:
+                user, token = super().authenticate_credentials(key)
+            except AuthenticationFailed:
+                if router.db_for_read(Token) == DEFAULT_DB_ALIAS:
+                    raise
+                user, token = self.authenticate_on_primary(key)
+            remember_token(key, user)
+            return user, token
+        user = pickle.loads(data)
+        return user, Token(key=key, user=user)
+
+    def authenticate_on_primary(self, key):
+        created_after = timezone.now() - timedelta(
+            seconds=settings.REPLICA_PIN_SECONDS
+        )
+        token = Token.objects.using(DEFAULT_DB_ALIAS).select_related(
+            'user'
+        ).filter(key=key, created__gte=created_after).first()
+        if token is None:
+            raise AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return token.user, token
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    Для чтения access-токен проверяется только по подписи и сроку
+    действия: пользователь собирается из claims без запроса к базе.
+    Изменяющие запросы по-прежнему читают пользователя и проверяют,
+    что он активен.
+    """
+    def authenticate(self, request):
+        self.safe = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Токен не содержит id пользователя.')
+        if not self.safe:
+            return super().get_user(validated_token)
+        return JWTUser.from_token(
+            validated_token[api_settings.USER_ID_CLAIM],
+            validated_token.get('is_staff', False),
+        )
+
+
+def revoke_refresh_tokens(user_id):
+    """
+    Вносит все действующие refresh-токены пользователя в список
+    отозванных. Выданные access-токены доживают свой короткий срок.
+    """
+    tokens = OutstandingToken.objects.filter(
+        user_id=user_id,
+        expires_at__gt=timezone.now(),
+        blacklistedtoken__isnull=True,
+    ).values_list('pk', flat=True)
+    BlacklistedToken.objects.bulk_create(
+        (BlacklistedToken(token_id=pk) for pk in tokens),
+        ignore_conflicts=True,
+    )
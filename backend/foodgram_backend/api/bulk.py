@@ -0,0 +1,69 @@
+from django.db import connection
+
+ADD_SQL = '''
+    INSERT INTO {table} ({owner}, {target}{extra_columns})
+    SELECT %s, {target_pk}{extra_values} FROM {target_table}
+    WHERE {target_pk} IN ({ids})
+    ON CONFLICT DO NOTHING
+    RETURNING {target}
+'''
+
+REMOVE_SQL = '''
+    DELETE FROM {table}
+    WHERE {owner} = %s AND {target} IN ({ids})
+    RETURNING {target}
+'''
+
+
+def format_sql(sql, model, owner_field, target_field, ids, extra=()):
+    quote = connection.ops.quote_name
+    target = model._meta.get_field(target_field)
+    target_meta = target.related_model._meta
+    return sql.format(
+        table=quote(model._meta.db_table),
+        owner=quote(model._meta.get_field(owner_field).column),
+        target=quote(target.column),
+        target_table=quote(target_meta.db_table),
+        target_pk=quote(target_meta.pk.column),
+        extra_columns=''.join(
+            f', {quote(model._meta.get_field(name).column)}'
+            for name in extra
+        ),
+        extra_values=', %s' * len(extra),
+        ids=', '.join(['%s'] * len(ids)),
+    )
+
+
+def add_links(model, owner_field, target_field, owner_id, target_ids,
+              **extra):
+    """
+    Создает связи владельца с целями одним INSERT ... SELECT
+    с ON CONFLICT DO NOTHING: повторы не дают ошибки, несуществующие
+    цели пропускаются. Сигналы не вызываются. Возвращает id целей,
+    для которых связь создана этим запросом.
+    """
+    target_ids = list(target_ids)
+    if not target_ids:
+        return []
+    sql = format_sql(
+        ADD_SQL, model, owner_field, target_field, target_ids, extra
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [owner_id, *extra.values(), *target_ids])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def remove_links(model, owner_field, target_field, owner_id, target_ids):
+    """
+    Удаляет связи владельца с целями одним DELETE без сигналов.
+    Возвращает id целей, связь с которыми была удалена.
+    """
+    target_ids = list(target_ids)
+    if not target_ids:
+        return []
+    sql = format_sql(
+        REMOVE_SQL, model, owner_field, target_field, target_ids
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [owner_id, *target_ids])
+        return [row[0] for row in cursor.fetchall()]
@@ -5,5 +5,77 @@ MAX_TEG_LENGTH = 100
 DEF_PAGE_SIZE = 10
 MAX_PAGE_SIZE = 100
 MAX_LEN_SL = 3
+SHORT_URL_MAX_LENGTH = 20
+SHORT_URL_CACHE_SIZE = 10000
+SHORT_URL_NEGATIVE_TTL = 300
+SHORT_URL_KNOWN_TTL = 60
+SHORT_URL_REDIRECT_MAX_AGE = 60 * 60 * 24
 CUR_BASE_URL = 'https://foodgram1304.servebeer.com/'
 # CUR_BASE_URL = 'http://127.0.0.1:8000/'
+COUNT_CACHE_TTL = 60
+COUNT_ESTIMATE_THRESHOLD = 100000
+COUNT_STRATEGY_HEADER = 'X-Count-Strategy'
+IMAGE_VARIANTS = {
+    'card': 480,
+    'detail': 960,
+    'retina': 1920,
+}
+IMAGE_VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+IMAGE_VARIANTS_DIR = 'recipes/variants'
+LIST_IMAGE_VARIANT = 'card'
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+RECIPE_FRAGMENT_TTL = 60 * 60 * 24
+SEARCH_CONFIG = 'russian'
+SEARCH_HEADLINE_LENGTH = 200
+SEARCH_HEADLINE_OPTIONS = {
+    'start_sel': '<mark>',
+    'stop_sel': '</mark>',
+    'max_words': 35,
+    'min_words': 15,
+    'max_fragments': 2,
+}
+TAG_CACHE_TTL = 5 * 60
+FEED_MAX_LENGTH = 1000
+FEED_TRIM_EVERY = 50
+FEED_FAN_OUT_MAX_SUBSCRIBERS = 10000
+FEED_FAN_OUT_RESUME_SUBSCRIBERS = 9000
+FEED_BACKFILL_SIZE = 50
+RECOMMENDATIONS_TOP_K = 10
+RECOMMENDATIONS_CART_WEIGHT = 0.5
+RECOMMENDATIONS_CHUNK_SIZE = 256
+RECOMMENDATIONS_READ_SIZE = 100000
+MINHASH_PERMUTATIONS = 64
+MINHASH_SEED = 20261017
+LSH_BANDS = 32
+SIMILARITY_THRESHOLD = 0.3
+SIMILARITY_MAX_CANDIDATES = 200
+DUPLICATE_BANDS = 8
+DUPLICATE_THRESHOLD = 0.8
+# Единица списка покупок -> (каноническая единица, множитель).
+UNIT_CONVERSIONS = {
+    'мг': ('г', 0.001),
+    'г': ('г', 1),
+    'кг': ('г', 1000),
+    'мл': ('мл', 1),
+    'л': ('мл', 1000),
+    'капля': ('мл', 0.05),
+    'ч. л.': ('мл', 5),
+    'ст. л.': ('мл', 15),
+    'стакан': ('мл', 250),
+    'шт': ('шт.', 1),
+    'шт.': ('шт.', 1),
+}
+# Единицы вывода для канонической единицы, от крупной к мелкой.
+OUTPUT_UNITS = {
+    'г': (('кг', 1000), ('г', 1)),
+    'мл': (('л', 1000), ('мл', 1)),
+}
+UNITS_WITHOUT_AMOUNT = {'по вкусу'}
+BULK_MAX_IDS = 100
+AUTH_CACHE_SIZE = 10000
+AUTH_CACHE_TTL = 5 * 60
+AUTH_LOCAL_TTL = 30
+AUTH_STATS_FLUSH_EVERY = 100
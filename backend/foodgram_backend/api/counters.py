@@ -0,0 +1,73 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import MyUser, Subscription
+from .models import Favorite, Recipe, ShoppingCart
+
+
+def change_counter(model, pk, field, delta):
+    """
+    Атомарно меняет счетчик на delta: UPDATE ... SET field = field + delta.
+    """
+    return model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def change_counters(model, pks, field, delta):
+    """
+    То же для нескольких строк одним UPDATE.
+    """
+    return model.objects.filter(pk__in=pks).update(
+        **{field: F(field) + delta}
+    )
+
+
+def count_of(model, field):
+    """
+    Подзапрос с числом строк model, ссылающихся на текущий объект.
+    """
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')}).order_by()
+            .values(field).annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def rebuild(queryset, counters):
+    """
+    Пересчитывает счетчики одним UPDATE только у расходящихся строк.
+    counters: {поле счетчика: (модель, поле связи)}.
+    """
+    actual = {
+        f'actual_{field}': count_of(*source)
+        for field, source in counters.items()
+    }
+    mismatch = Q()
+    for field in counters:
+        mismatch |= ~Q(**{field: F(f'actual_{field}')})
+    stale = queryset.annotate(**actual).filter(mismatch).values('pk')
+    return queryset.model.objects.filter(pk__in=stale).update(**{
+        field: count_of(*source) for field, source in counters.items()
+    })
+
+
+def rebuild_recipe_counters(queryset=None):
+    return rebuild(
+        Recipe.objects.all() if queryset is None else queryset,
+        {
+            'favorites_count': (Favorite, 'recipe'),
+            'carts_count': (ShoppingCart, 'recipe'),
+        },
+    )
+
+
+def rebuild_user_counters(queryset=None):
+    return rebuild(
+        MyUser.objects.all() if queryset is None else queryset,
+        {
+            'recipes_count': (Recipe, 'author'),
+            'subscribers_count': (Subscription, 'subscribed_to'),
+        },
+    )
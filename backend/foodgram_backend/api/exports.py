@@ -0,0 +1,165 @@
+import csv
+from html import escape
+
+import numpy as np
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+
+from .constants import OUTPUT_UNITS, UNIT_CONVERSIONS, UNITS_WITHOUT_AMOUNT
+from .models import RecipeIngredient
+
+SHOPPING_LIST_FILENAME = 'shopping_cart'
+
+
+class Echo:
+    """
+    Псевдобуфер для csv.writer: возвращает строку вместо записи.
+    """
+    def write(self, value):
+        return value
+
+
+def get_shopping_list(user):
+    """
+    Суммирует ингредиенты всех рецептов из списка покупок
+    пользователя одним сгруппированным запросом.
+    """
+    return (
+        RecipeIngredient.objects
+        .filter(recipe__in_shopping_cart__user=user)
+        .values('ingredient__name', 'ingredient__measurement_unit')
+        .annotate(total=Sum('amount'))
+        .order_by('ingredient__name', 'ingredient__measurement_unit')
+    )
+
+
+def format_amount(value):
+    return f'{value:.2f}'.rstrip('0').rstrip('.')
+
+
+def normalize_units(rows):
+    """
+    Переводит суммы в каноническую единицу по UNIT_CONVERSIONS,
+    складывает один ингредиент в разных единицах (500 г и 1 кг муки)
+    и выбирает единицу вывода по OUTPUT_UNITS. Все шаги - операции
+    над массивами по строкам сгруппированного запроса.
+    Возвращает строки {name, total, unit}, отсортированные по названию.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    names = np.array(
+        [row['ingredient__name'] for row in rows], dtype=object
+    )
+    totals = np.array([row['total'] for row in rows], dtype=np.float64)
+    units, unit_index = np.unique(
+        np.array(
+            [row['ingredient__measurement_unit'] for row in rows],
+            dtype=object,
+        ),
+        return_inverse=True,
+    )
+    # Справочные значения считаются по различным единицам,
+    # а на строки раскладываются индексами.
+    unit_canonical = []
+    unit_factors = []
+    unit_on_scale = []
+    for unit in units:
+        key = unit.strip().lower()
+        canonical, factor = UNIT_CONVERSIONS.get(key, (unit, 1))
+        unit_canonical.append(canonical)
+        unit_factors.append(factor)
+        unit_on_scale.append(key in dict(OUTPUT_UNITS.get(canonical, ())))
+    unit_canonical = np.array(unit_canonical, dtype=object)
+    unit_factors = np.array(unit_factors, dtype=np.float64)
+    canonical = unit_canonical[unit_index]
+    amounts = totals * unit_factors[unit_index]
+
+    keys, first, group_index = np.unique(
+        names + '\0' + canonical, return_index=True, return_inverse=True
+    )
+    sums = np.bincount(group_index, weights=amounts)
+    group_canonical = canonical[first]
+    output = group_canonical.copy()
+    values = sums.copy()
+    for unit, scale in OUTPUT_UNITS.items():
+        mask = group_canonical == unit
+        for output_unit, factor in reversed(scale):
+            chosen = mask & (sums >= factor)
+            output[chosen] = output_unit
+            values[chosen] = sums[chosen] / factor
+    # Группу из одной единицы вне шкалы вывода (например, ч. л.)
+    # оставляем как есть, а не пересчитываем в мл.
+    group_units = np.bincount(group_index)
+    source = unit_index[first]
+    keep = (group_units == 1) & ~np.array(unit_on_scale)[source]
+    output[keep] = units[source[keep]]
+    values[keep] = sums[keep] / unit_factors[source[keep]]
+    return [
+        {
+            'name': name,
+            'total': (
+                '' if unit in UNITS_WITHOUT_AMOUNT else format_amount(value)
+            ),
+            'unit': unit,
+        }
+        for name, value, unit in zip(names[first], values, output)
+    ]
+
+
+def render_txt(rows):
+    for row in rows:
+        amount = ' '.join(filter(None, (row['total'], row['unit'])))
+        yield f'{row["name"]} - {amount}\n'
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    # BOM нужен, чтобы Excel корректно открыл кириллицу.
+    yield '\ufeff'
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единица измерения'))
+    for row in rows:
+        yield writer.writerow((row['name'], row['total'], row['unit']))
+
+
+def render_html(rows):
+    yield (
+        '<!DOCTYPE html><html lang="ru"><head><meta charset="utf-8">'
+        '<title>Список покупок</title><style>'
+        'body{font-family:sans-serif}'
+        'li{padding:4px 0;border-bottom:1px dotted #999}'
+        '@media print{@page{margin:15mm}}'
+        '</style></head><body onload="window.print()">'
+        '<h1>Список покупок</h1><ul>'
+    )
+    for row in rows:
+        amount = ' '.join(filter(None, (row['total'], row['unit'])))
+        yield (
+            f'<li>&#9744; {escape(row["name"])} — {escape(amount)}</li>'
+        )
+    yield '</ul></body></html>'
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8', 'txt'),
+    'csv': (render_csv, 'text/csv; charset=utf-8', 'csv'),
+    'print': (render_html, 'text/html; charset=utf-8', 'html'),
+}
+
+
+def shopping_list_response(user, export_format):
+    """
+    Возвращает потоковый ответ со списком покупок в нужном формате.
+    Формат print отдается как страница для печати, сохранение
+    в PDF выполняет браузер.
+    """
+    renderer, content_type, extension = SHOPPING_LIST_FORMATS[export_format]
+    response = StreamingHttpResponse(
+        renderer(normalize_units(get_shopping_list(user))),
+        content_type=content_type,
+    )
+    disposition = 'inline' if extension == 'html' else 'attachment'
+    response['Content-Disposition'] = (
+        f'{disposition}; filename={SHOPPING_LIST_FILENAME}.{extension}'
+    )
+    return response
@@ -0,0 +1,190 @@
+from django.db import connection, transaction
+
+from users.models import MyUser, Subscription
+from .constants import (
+    FEED_BACKFILL_SIZE,
+    FEED_FAN_OUT_MAX_SUBSCRIBERS,
+    FEED_FAN_OUT_RESUME_SUBSCRIBERS,
+    FEED_MAX_LENGTH,
+    FEED_TRIM_EVERY,
+)
+from .models import FeedItem, Recipe
+
+FAN_OUT_SQL = '''
+    INSERT INTO {feed_table} (user_id, recipe_id, created_at)
+    SELECT subscription.subscriber_id, recipe.id, recipe.created_at
+    FROM {recipe_table} recipe
+    JOIN {subscription_table} subscription
+        ON subscription.subscribed_to_id = recipe.author_id
+    WHERE recipe.id = %s
+    ON CONFLICT DO NOTHING
+'''
+
+AUTHOR_BACKFILL_SQL = '''
+    INSERT INTO {feed_table} (user_id, recipe_id, created_at)
+    SELECT subscription.subscriber_id, recipe.id, recipe.created_at
+    FROM (
+        SELECT id, created_at FROM {recipe_table}
+        WHERE author_id = %s
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    ) AS recipe
+    CROSS JOIN {subscription_table} subscription
+    WHERE subscription.subscribed_to_id = %s
+    ON CONFLICT DO NOTHING
+'''
+
+BACKFILL_SQL = '''
+    INSERT INTO {feed_table} (user_id, recipe_id, created_at)
+    SELECT %s, id, created_at FROM {recipe_table}
+    WHERE author_id = %s
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+    ON CONFLICT DO NOTHING
+'''
+
+REBUILD_SQL = '''
+    INSERT INTO {feed_table} (user_id, recipe_id, created_at)
+    SELECT subscriber_id, recipe_id, created_at FROM (
+        SELECT subscription.subscriber_id, recipe.id AS recipe_id,
+            recipe.created_at, ROW_NUMBER() OVER (
+                PARTITION BY subscription.id
+                ORDER BY recipe.created_at DESC, recipe.id DESC
+            ) AS row_number
+        FROM {subscription_table} subscription
+        JOIN {user_table} author
+            ON author.id = subscription.subscribed_to_id
+        JOIN {recipe_table} recipe ON recipe.author_id = author.id
+        WHERE subscription.subscriber_id >= %s
+            AND subscription.subscriber_id < %s
+            AND NOT author.fan_out_on_read
+    ) AS ranked
+    WHERE row_number <= %s
+    ON CONFLICT DO NOTHING
+'''
+
+# Оставляет в лентах выбранных пользователей (условие users)
+# не больше %s последних записей.
+TRIM_SQL = '''
+    DELETE FROM {feed_table} WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY user_id ORDER BY created_at DESC, recipe_id DESC
+            ) AS row_number
+            FROM {feed_table}
+            WHERE {users}
+        ) AS ranked
+        WHERE row_number > %s
+    )
+'''
+
+# Пользователи, чьи ленты обрезаются после записи. Обрезка ленты
+# читает ее целиком, поэтому после публикации обрезается только каждая
+# FEED_TRIM_EVERY-я лента подписчиков: лента превышает FEED_MAX_LENGTH
+# в среднем на FEED_TRIM_EVERY записей.
+AUTHOR_SUBSCRIBERS = '''user_id IN (
+    SELECT subscriber_id FROM {subscription_table}
+    WHERE subscribed_to_id = %s AND subscriber_id %% %s = %s
+)'''
+ONE_USER = 'user_id = %s'
+USER_RANGE = 'user_id >= %s AND user_id < %s'
+ALL_USERS = '1 = 1'
+
+
+def format_sql(sql, **kwargs):
+    return sql.format(
+        feed_table=FeedItem._meta.db_table,
+        recipe_table=Recipe._meta.db_table,
+        subscription_table=Subscription._meta.db_table,
+        user_table=MyUser._meta.db_table,
+        **kwargs,
+    )
+
+
+def trim_feeds(cursor, users, params, max_length=None):
+    """
+    Обрезает ленты пользователей из условия users до max_length
+    (по умолчанию FEED_MAX_LENGTH) последних записей.
+    Возвращает число удаленных записей.
+    """
+    cursor.execute(
+        format_sql(TRIM_SQL, users=format_sql(users)),
+        [*params, FEED_MAX_LENGTH if max_length is None else max_length],
+    )
+    return cursor.rowcount
+
+
+def fan_out_recipe(recipe_id):
+    """
+    Раскладывает новый рецепт по лентам подписчиков автора одним
+    INSERT ... SELECT и обрезает часть этих лент до FEED_MAX_LENGTH.
+    Автор с подписчиками сверх FEED_FAN_OUT_MAX_SUBSCRIBERS переводится
+    на чтение при запросе. Когда их становится не больше
+    FEED_FAN_OUT_RESUME_SUBSCRIBERS, раскладка возобновляется: ленты
+    получают последние рецепты автора, как при новой подписке.
+    """
+    author = MyUser.objects.filter(recipes=recipe_id).only(
+        'fan_out_on_read', 'subscribers_count'
+    ).first()
+    if author is None:
+        return
+    # Порог возврата ниже порога перехода, чтобы автор на границе
+    # не переключался туда и обратно с каждым рецептом.
+    threshold = (
+        FEED_FAN_OUT_RESUME_SUBSCRIBERS if author.fan_out_on_read
+        else FEED_FAN_OUT_MAX_SUBSCRIBERS
+    )
+    if author.subscribers_count > threshold:
+        if not author.fan_out_on_read:
+            MyUser.objects.filter(pk=author.pk).update(fan_out_on_read=True)
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        if author.fan_out_on_read:
+            cursor.execute(
+                format_sql(AUTHOR_BACKFILL_SQL),
+                [author.pk, FEED_BACKFILL_SIZE, author.pk],
+            )
+            MyUser.objects.filter(pk=author.pk).update(fan_out_on_read=False)
+        else:
+            cursor.execute(format_sql(FAN_OUT_SQL), [recipe_id])
+        trim_feeds(cursor, AUTHOR_SUBSCRIBERS, [
+            author.pk, FEED_TRIM_EVERY, recipe_id % FEED_TRIM_EVERY,
+        ])
+
+
+def add_author_to_feed(subscriber_id, author_id):
+    """
+    После подписки добавляет в ленту последние рецепты автора.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            format_sql(BACKFILL_SQL),
+            [subscriber_id, author_id, FEED_BACKFILL_SIZE],
+        )
+        trim_feeds(cursor, ONE_USER, [subscriber_id])
+
+
+def rebuild_feeds(first_user_id, last_user_id):
+    """
+    Заполняет ленты подписчиков с id из [first_user_id, last_user_id)
+    последними рецептами их авторов, как при новой подписке.
+    Возвращает число добавленных записей.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            format_sql(REBUILD_SQL),
+            [first_user_id, last_user_id, FEED_BACKFILL_SIZE],
+        )
+        added = cursor.rowcount
+        trim_feeds(cursor, USER_RANGE, [first_user_id, last_user_id])
+    return added
+
+
+def remove_author_from_feed(subscriber_id, author_id):
+    remove_authors_from_feed(subscriber_id, [author_id])
+
+
+def remove_authors_from_feed(subscriber_id, author_ids):
+    FeedItem.objects.filter(
+        user_id=subscriber_id, recipe__author_id__in=author_ids
+    ).delete()
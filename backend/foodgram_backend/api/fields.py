@@ -0,0 +1,51 @@
+from pathlib import Path
+
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework import serializers
+
+
+class Base64OrFileImageField(Base64ImageField):
+    """
+    Изображение строкой base64 в JSON или файлом в multipart/form-data.
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            # Имя файла, как и для base64, генерируем сами.
+            data.name = self.get_file_name(data) + Path(data.name).suffix
+            return serializers.ImageField.to_internal_value(self, data)
+        return super().to_internal_value(data)
+
+
+class PrimaryKeyListField(serializers.ManyRelatedField):
+    """
+    Список первичных ключей, который проверяется одним запросом,
+    а не запросом на каждый элемент, как PrimaryKeyRelatedField.
+    """
+    def __init__(self, queryset, **kwargs):
+        super().__init__(
+            child_relation=serializers.PrimaryKeyRelatedField(
+                queryset=queryset
+            ),
+            **kwargs,
+        )
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        pks = []
+        for value in data:
+            if isinstance(value, bool):
+                child.fail('incorrect_type', data_type=type(value).__name__)
+            try:
+                pks.append(int(value))
+            except (TypeError, ValueError):
+                child.fail('incorrect_type', data_type=type(value).__name__)
+        objects = child.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                child.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in pks]
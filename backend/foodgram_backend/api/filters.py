@@ -1,6 +1,8 @@
 from django_filters import rest_framework as filters
+from django_filters.fields import MultipleChoiceField
 
-from .models import Ingredient, Recipe, Tag
+from .models import Ingredient, Recipe
+from .tags import get_tag_choices, is_known_slug, tag_slugs
 
 
 class IngredientFilter(filters.FilterSet):
@@ -17,6 +19,24 @@ class IngredientFilter(filters.FilterSet):
         fields = ('name',)
 
 
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """
+    Список чисел через запятую.
+    """
+
+
+class TagSlugField(MultipleChoiceField):
+    """
+    Список slug тегов, сверяемый с кешем тегов процесса.
+    """
+    def valid_value(self, value):
+        return is_known_slug(value)
+
+
+class TagSlugFilter(filters.MultipleChoiceFilter):
+    field_class = TagSlugField
+
+
 class RecipeFilter(filters.FilterSet):
     """
     Фильтр для рецептов.
@@ -26,15 +46,73 @@ class RecipeFilter(filters.FilterSet):
         method='filter_is_in_shopping_cart'
     )
     author = filters.NumberFilter(field_name='author__id')
-    tags = filters.ModelMultipleChoiceFilter(
-        queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug',
+    tags = TagSlugFilter(
+        choices=get_tag_choices,
+        method='filter_tags',
+    )
+    search = filters.CharFilter(method='filter_search')
+    have_ingredients = NumberInFilter(method='filter_have_ingredients')
+    max_missing = filters.NumberFilter(
+        method='filter_max_missing', min_value=0
+    )
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'popular'),),
+        method='filter_ordering',
     )
 
     class Meta:
         model = Recipe
-        fields = ['author', 'tags', 'is_favorited', 'is_in_shopping_cart']
+        fields = [
+            'author', 'tags', 'is_favorited', 'is_in_shopping_cart', 'search',
+            'have_ingredients', 'max_missing', 'ordering',
+        ]
+
+    def filter_have_ingredients(self, queryset, name, value):
+        """
+        Рецепты из имеющихся ингредиентов: сначала те,
+        для которых ничего не нужно докупать.
+        Допустимое число недостающих задает max_missing.
+        """
+        if not value:
+            return queryset
+        max_missing = self.form.cleaned_data.get('max_missing') or 0
+        return queryset.with_ingredients(
+            [int(pk) for pk in value], int(max_missing)
+        )
+
+    def filter_max_missing(self, queryset, name, value):
+        """
+        Используется вместе с have_ingredients.
+        """
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        """
+        Полнотекстовый поиск по названию, описанию и ингредиентам,
+        результаты упорядочены по релевантности.
+        """
+        value = value.strip()
+        if not value:
+            return queryset
+        return queryset.search(value)
+
+    def filter_tags(self, queryset, name, value):
+        """
+        Фильтрация по slug тегов без запроса к таблице тегов.
+        """
+        if not value:
+            return queryset
+        slugs = tag_slugs.get_all()
+        return queryset.with_tags(
+            [slugs[slug] for slug in value if slug in slugs]
+        )
+
+    def filter_ordering(self, queryset, name, value):
+        """
+        ordering=popular: сначала рецепты, которые чаще добавляют
+        в избранное. Использует индекс recipe_popular_idx.
+        """
+        return queryset.order_by('-favorites_count', '-created_at', '-id')
 
     def filter_is_favorited(self, queryset, name, value):
         """
@@ -0,0 +1,27 @@
+from django.core.cache import cache
+
+from .constants import RECIPE_FRAGMENT_TTL
+
+
+def get_fragment_key(recipe, context):
+    """
+    Ключ общего для всех пользователей представления рецепта.
+    Версия меняется при любом изменении рецепта, поэтому старые
+    ключи не удаляются, а просто перестают читаться.
+    Адрес сайта входит в ключ из-за абсолютных ссылок на изображения.
+    """
+    request = context.get('request')
+    origin = (
+        f'{request.scheme}://{request.get_host()}' if request else ''
+    )
+    variant = context.get('image_variant') or ''
+    return f'recipe_fragment:{recipe.pk}:{recipe.version}:{variant}:{origin}'
+
+
+def get_fragments(keys):
+    return cache.get_many(keys)
+
+
+def set_fragments(fragments):
+    if fragments:
+        cache.set_many(fragments, RECIPE_FRAGMENT_TTL)
@@ -0,0 +1,133 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from PIL import Image, ImageOps
+
+from .constants import (
+    IMAGE_VARIANT_FORMATS,
+    IMAGE_VARIANTS,
+    IMAGE_VARIANTS_DIR,
+)
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='recipe-images',
+        )
+    return _executor
+
+
+def variant_path(image_name, variant, extension):
+    stem = PurePosixPath(image_name).stem
+    return f'{IMAGE_VARIANTS_DIR}/{stem}/{variant}.{extension}'
+
+
+def get_variant_urls(recipe, request=None):
+    """
+    Карта {вариант: {формат: url}} для готовых вариантов изображения.
+    """
+    urls = {}
+    variants = (recipe.image_variants or {}).get('variants', {})
+    for variant, formats in variants.items():
+        urls[variant] = {}
+        for extension, path in formats.items():
+            url = default_storage.url(path)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[variant][extension] = url
+    return urls
+
+
+def render_variants(image_file):
+    """
+    Нарезает исходное изображение на варианты всех размеров
+    и форматов. Возвращает словарь {(variant, format): bytes}.
+    """
+    with Image.open(image_file) as source:
+        source = ImageOps.exif_transpose(source).convert('RGB')
+        rendered = {}
+        for variant, size in IMAGE_VARIANTS.items():
+            image = source.copy()
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            for extension, (pil_format, options) in (
+                IMAGE_VARIANT_FORMATS.items()
+            ):
+                buffer = BytesIO()
+                image.save(buffer, pil_format, **options)
+                rendered[variant, extension] = buffer.getvalue()
+    return rendered
+
+
+def delete_variants(image_variants):
+    for formats in image_variants.get('variants', {}).values():
+        for path in formats.values():
+            default_storage.delete(path)
+
+
+def process_recipe_image(recipe_id, force=False):
+    """
+    Создает варианты изображения рецепта. Повторный вызов для того же
+    изображения ничего не делает, если не передан force.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'image', 'image_variants'
+    ).first()
+    if recipe is None or not recipe.image:
+        return
+    current = recipe.image_variants or {}
+    if current.get('source') == recipe.image.name and not force:
+        return
+    if current.get('source') != recipe.image.name:
+        delete_variants(current)
+
+    with recipe.image.open('rb') as image_file:
+        rendered = render_variants(image_file)
+    variants = {}
+    for (variant, extension), content in rendered.items():
+        path = variant_path(recipe.image.name, variant, extension)
+        default_storage.delete(path)
+        default_storage.save(path, ContentFile(content))
+        variants.setdefault(variant, {})[extension] = path
+    # Обновляем только если изображение не успели заменить.
+    Recipe.objects.filter(pk=recipe_id, image=recipe.image.name).update(
+        image_variants={'source': recipe.image.name, 'variants': variants},
+        version=F('version') + 1,
+    )
+
+
+def run_in_worker(recipe_id):
+    try:
+        process_recipe_image(recipe_id)
+    except Exception:
+        logger.exception(
+            'Не удалось обработать изображение рецепта %s', recipe_id
+        )
+    finally:
+        close_old_connections()
+
+
+def schedule_recipe_image(recipe_id):
+    """
+    Ставит обработку изображения в пул после фиксации транзакции.
+    """
+    if not settings.IMAGE_WORKERS:
+        transaction.on_commit(lambda: process_recipe_image(recipe_id))
+        return
+    transaction.on_commit(
+        lambda: get_executor().submit(run_in_worker, recipe_id)
+    )
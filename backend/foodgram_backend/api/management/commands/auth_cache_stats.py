@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from api.authentication import AUTH_STATS, auth_stats
+from foodgram_backend.caches import is_shared_cache
+
+
+class Command(BaseCommand):
+    help = (
+        'Показывает долю проверок токенов, обслуженных кешем, '
+        'по счетчикам всех процессов в общем кеше.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Обнулить счетчики после вывода.',
+        )
+
+    def handle(self, *args, **options):
+        if not is_shared_cache():
+            self.stderr.write(self.style.WARNING(
+                'Кеш не общий (не задан MEMCACHED_LOCATION): счетчики '
+                'воркеров команде не видны.'
+            ))
+        counts = auth_stats.get_shared()
+        total = sum(counts.values())
+        hits = counts['local'] + counts['shared']
+        for name in AUTH_STATS:
+            self.stdout.write(f'{name}: {counts[name]}')
+        rate = hits / total if total else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Попаданий: {hits} из {total} ({rate:.1%}).'
+        ))
+        if options['reset']:
+            auth_stats.reset_shared()
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Recipe
+from api.shortlinks import encode
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Назначает короткие коды рецептам, у которых их еще нет.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Количество рецептов, обновляемых за раз.',
+        )
+
+    def handle(self, *args, **options):
+        queryset = Recipe.objects.filter(short_url__isnull=True).only('id')
+        total = 0
+        while True:
+            batch = list(queryset.order_by('pk')[:options['batch_size']])
+            if not batch:
+                break
+            for recipe in batch:
+                recipe.short_url = encode(recipe.pk)
+            Recipe.objects.bulk_update(batch, ['short_url'])
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Назначено коротких кодов: {total}.'
+        ))
@@ -0,0 +1,134 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, Max, OuterRef
+
+from api.constants import (
+    RECOMMENDATIONS_CART_WEIGHT,
+    RECOMMENDATIONS_CHUNK_SIZE,
+    RECOMMENDATIONS_READ_SIZE,
+    RECOMMENDATIONS_TOP_K,
+)
+from api.models import (
+    Favorite,
+    RecommendationBuild,
+    ShoppingCart,
+    SimilarRecipe,
+)
+from api.recommendations import (
+    build_matrix,
+    find_related,
+    iter_neighbours,
+    load_pairs,
+    save_neighbours,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает похожие рецепты по совместным добавлениям в избранное '
+        'и список покупок. С --incremental пересчитываются только '
+        'рецепты, которые добавляли после прошлого расчета, и рецепты, '
+        'близкие к ним. Удаления из избранного и покупок учитывает '
+        'только полный расчет.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=RECOMMENDATIONS_TOP_K,
+            help='Сколько похожих рецептов хранить для каждого рецепта.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=RECOMMENDATIONS_CHUNK_SIZE,
+            help='Сколько рецептов обрабатывать за один блок.',
+        )
+        parser.add_argument(
+            '--cart-weight', type=float,
+            default=RECOMMENDATIONS_CART_WEIGHT,
+            help='Вес добавления в список покупок относительно избранного.',
+        )
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help=(
+                'Пересчитать только рецепты с новыми добавлениями '
+                'и рецепты, в top-k которых они могут попасть.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        last_favorite_id = Favorite.objects.aggregate(
+            last=Max('id')
+        )['last'] or 0
+        last_cart_id = ShoppingCart.objects.aggregate(
+            last=Max('id')
+        )['last'] or 0
+        favorites = Favorite.objects.filter(pk__lte=last_favorite_id)
+        carts = ShoppingCart.objects.filter(pk__lte=last_cart_id)
+
+        matrix, recipe_ids = build_matrix([
+            (load_pairs(favorites, RECOMMENDATIONS_READ_SIZE), 1.0),
+            (
+                load_pairs(carts, RECOMMENDATIONS_READ_SIZE),
+                options['cart_weight'],
+            ),
+        ])
+        if options['incremental']:
+            columns = find_related(
+                matrix,
+                self.get_changed_columns(recipe_ids, favorites, carts),
+                options['chunk_size'],
+            )
+        else:
+            columns = np.arange(len(recipe_ids))
+        self.stderr.write(
+            f'Матрица {matrix.shape[0]} x {matrix.shape[1]}, '
+            f'ненулевых {matrix.nnz}, к пересчету рецептов: {len(columns)}.'
+        )
+
+        for chunk, rows, neighbours, scores in iter_neighbours(
+            matrix, columns, options['top_k'], options['chunk_size']
+        ):
+            save_neighbours(
+                recipe_ids[chunk],
+                recipe_ids[rows],
+                recipe_ids[neighbours],
+                scores,
+            )
+
+        if not options['incremental']:
+            # Рецепты, которые больше никто не добавляет, без рекомендаций.
+            SimilarRecipe.objects.exclude(
+                Exists(Favorite.objects.filter(recipe=OuterRef('recipe')))
+            ).exclude(
+                Exists(ShoppingCart.objects.filter(recipe=OuterRef('recipe')))
+            ).delete()
+        RecommendationBuild.objects.create(
+            last_favorite_id=last_favorite_id,
+            last_cart_id=last_cart_id,
+            recipes=len(columns),
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано рецептов: {len(columns)} за {elapsed:.2f} с.'
+        ))
+
+    @staticmethod
+    def get_changed_columns(recipe_ids, favorites, carts):
+        """
+        Столбцы рецептов, которые добавляли в избранное или покупки
+        после прошлого расчета.
+        """
+        previous = RecommendationBuild.objects.first()
+        if previous is None:
+            raise CommandError(
+                'Прошлого расчета нет, запустите команду без --incremental.'
+            )
+        changed = set(favorites.filter(
+            pk__gt=previous.last_favorite_id
+        ).values_list('recipe_id', flat=True))
+        changed.update(carts.filter(
+            pk__gt=previous.last_cart_id
+        ).values_list('recipe_id', flat=True))
+        return np.flatnonzero(np.isin(recipe_ids, list(changed)))
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.models import Recipe
+from api.similarity import update_signatures
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает подписи MinHash и корзины LSH для поиска '
+        'рецептов с похожими ингредиентами.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Количество рецептов, обновляемых за раз.',
+        )
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Обработать только рецепты без подписи.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        queryset = Recipe.objects.order_by('pk')
+        if options['missing']:
+            queryset = queryset.filter(signature__isnull=True)
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_id).values_list(
+                'pk', flat=True
+            )[:options['batch_size']])
+            if not batch:
+                break
+            update_signatures(batch)
+            last_id = batch[-1]
+            total += len(batch)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано рецептов: {total} за {elapsed:.2f} с.'
+        ))
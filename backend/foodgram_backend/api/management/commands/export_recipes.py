@@ -0,0 +1,116 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from api.models import Favorite, Recipe, RecipeIngredient, ShoppingCart
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def recipe_document(recipe):
+    """
+    Представление рецепта для переноса между окружениями.
+    Связанные объекты задаются естественными ключами, а не id.
+    """
+    return {
+        'id': recipe.pk,
+        'author': recipe.author.email,
+        'name': recipe.name,
+        'text': recipe.text,
+        'cooking_time': recipe.cooking_time,
+        'image': recipe.image.name,
+        'created_at': recipe.created_at.isoformat(),
+        'tags': [tag.slug for tag in recipe.tags.all()],
+        'ingredients': [
+            {
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in recipe.recipe_ingredients.all()
+        ],
+        'favorited_by': [
+            item.user.email for item in recipe.favorited_by.all()
+        ],
+        'in_shopping_cart': [
+            item.user.email for item in recipe.in_shopping_cart.all()
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает рецепты в NDJSON: один рецепт в строке, '
+        'изображения передаются путями внутри MEDIA_ROOT.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', '-o',
+            help='Файл для выгрузки, по умолчанию stdout.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Количество рецептов, читаемых из базы за раз.',
+        )
+        parser.add_argument(
+            '--after-id', type=int, default=0,
+            help='Выгрузить только рецепты с id больше указанного.',
+        )
+
+    def iter_batches(self, batch_size, after_id):
+        """
+        Читает рецепты пачками по возрастанию id (keyset),
+        подгружая связанные данные для каждой пачки.
+        """
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ),
+            ),
+            Prefetch(
+                'favorited_by',
+                queryset=Favorite.objects.select_related('user'),
+            ),
+            Prefetch(
+                'in_shopping_cart',
+                queryset=ShoppingCart.objects.select_related('user'),
+            ),
+        ).order_by('pk')
+        while True:
+            batch = list(queryset.filter(pk__gt=after_id)[:batch_size])
+            if not batch:
+                return
+            yield batch
+            after_id = batch[-1].pk
+
+    def handle(self, *args, **options):
+        output = (
+            open(options['output'], 'w', encoding='utf-8')
+            if options['output'] else sys.stdout
+        )
+        started = time.monotonic()
+        total = 0
+        try:
+            for batch in self.iter_batches(
+                options['batch_size'], options['after_id']
+            ):
+                output.writelines(
+                    json.dumps(recipe_document(recipe), ensure_ascii=False)
+                    + '\n'
+                    for recipe in batch
+                )
+                total += len(batch)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        elapsed = time.monotonic() - started
+        self.stderr.write(
+            f'Выгружено рецептов: {total} за {elapsed:.2f} с.'
+        )
@@ -0,0 +1,45 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.images import process_recipe_image
+from api.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает уменьшенные копии изображений для существующих '
+        'рецептов. Уже обработанные изображения пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать варианты даже для обработанных изображений.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Количество потоков обработки.',
+        )
+
+    def handle(self, *args, **options):
+        force = options['force']
+
+        def process(recipe_id):
+            try:
+                process_recipe_image(recipe_id, force=force)
+            except Exception as error:
+                self.stderr.write(f'Рецепт {recipe_id}: {error}')
+            finally:
+                close_old_connections()
+
+        recipe_ids = Recipe.objects.values_list('id', flat=True).iterator()
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            total = sum(1 for _ in executor.map(process, recipe_ids))
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано рецептов: {total} '
+            f'за {time.monotonic() - started:.2f} с.'
+        ))
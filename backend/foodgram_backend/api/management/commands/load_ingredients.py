@@ -0,0 +1,173 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.models import Ingredient
+
+DEFAULT_PATH = Path(settings.BASE_DIR) / 'data' / 'ingredients.json'
+DEFAULT_BATCH_SIZE = 5000
+READ_CHUNK_SIZE = 64 * 1024
+STAGING_TABLE = 'ingredient_staging'
+
+
+def iter_json_array(file):
+    """
+    Потоково разбирает JSON-массив объектов, не загружая файл целиком.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise CommandError('Ожидался JSON-массив.')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise CommandError('Файл JSON поврежден.')
+            else:
+                yield item
+                continue
+        elif eof:
+            raise CommandError('Файл JSON оборвался.')
+        chunk = file.read(READ_CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_rows(path, file_format):
+    """
+    Возвращает пары (name, measurement_unit) из JSON или CSV.
+    """
+    with open(path, encoding='utf-8', newline='') as file:
+        if file_format == 'csv':
+            for row in csv.reader(file):
+                if len(row) >= 2:
+                    yield row[0], row[1]
+            return
+        for item in iter_json_array(file):
+            yield item['name'], item['measurement_unit']
+
+
+def iter_batches(rows, batch_size):
+    """
+    Нарезает поток строк на пачки без дублей внутри пачки.
+    """
+    while True:
+        rows_batch = list(islice(rows, batch_size))
+        if not rows_batch:
+            return
+        yield {
+            (name.strip(), unit.strip())
+            for name, unit in rows_batch
+            if name.strip()
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из JSON или CSV пачками. '
+        'Повторный запуск не создает дублей.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=str(DEFAULT_PATH),
+            help='Путь к файлу ингредиентов (.json или .csv).',
+        )
+        parser.add_argument(
+            '--format', choices=('json', 'csv'),
+            help='Формат файла, по умолчанию определяется по расширению.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Количество строк в одной пачке.',
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден.')
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in ('json', 'csv'):
+            raise CommandError('Поддерживаются только файлы JSON и CSV.')
+
+        use_copy = connection.vendor == 'postgresql'
+        load_batch = self.copy_batch if use_copy else self.bulk_create_batch
+
+        started = time.monotonic()
+        total = 0
+        with transaction.atomic():
+            if use_copy:
+                self.create_staging_table()
+            for batch in iter_batches(
+                iter_rows(path, file_format), options['batch_size']
+            ):
+                load_batch(batch)
+                total += len(batch)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано строк: {total} за {elapsed:.2f} с '
+            f'({total / elapsed if elapsed else total:.0f} строк/с). '
+            f'Ингредиентов в базе: {Ingredient.objects.count()}.'
+        ))
+
+    @staticmethod
+    def bulk_create_batch(batch):
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=unit)
+                for name, unit in batch
+            ),
+            ignore_conflicts=True,
+        )
+
+    @staticmethod
+    def create_staging_table():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE {STAGING_TABLE} '
+                f'(name text, measurement_unit text) ON COMMIT DROP'
+            )
+
+    @staticmethod
+    def copy_batch(batch):
+        """
+        Загружает пачку через COPY во временную таблицу и переносит
+        новые строки в таблицу ингредиентов через ON CONFLICT.
+        """
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {STAGING_TABLE} (name, measurement_unit) '
+                f'FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT name, measurement_unit FROM {STAGING_TABLE} '
+                f'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            cursor.execute(f'TRUNCATE {STAGING_TABLE}')
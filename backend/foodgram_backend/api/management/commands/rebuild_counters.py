@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.counters import rebuild_recipe_counters, rebuild_user_counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счетчики избранного, списков покупок, рецептов '
+        'и подписчиков. Обновляются только расходящиеся строки.'
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        recipes = rebuild_recipe_counters()
+        users = rebuild_user_counters()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено рецептов: {recipes}, пользователей: {users} '
+            f'за {elapsed:.2f} с.'
+        ))
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from api.feeds import rebuild_feeds
+from users.models import Subscription
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет ленты по существующим подпискам: последние рецепты '
+        'каждого автора, как при новой подписке. Записи, которые уже '
+        'есть в ленте, не дублируются, поэтому команду можно повторять.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Сколько подписчиков (по диапазону id) заполнять за раз.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        last_id = Subscription.objects.aggregate(
+            last_id=Max('subscriber_id')
+        )['last_id'] or 0
+        total = 0
+        for first_id in range(0, last_id + 1, options['batch_size']):
+            total += rebuild_feeds(first_id, first_id + options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено записей ленты: {total} за {elapsed:.2f} с.'
+        ))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.constants import FEED_MAX_LENGTH
+from api.feeds import ALL_USERS, trim_feeds
+
+
+class Command(BaseCommand):
+    help = (
+        'Обрезает все ленты до заданной длины. Ленты обрезаются и при '
+        'каждой записи в них; команда нужна после уменьшения длины.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-length', type=int, default=FEED_MAX_LENGTH,
+            help='Сколько последних записей оставить в каждой ленте.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with connection.cursor() as cursor:
+            deleted = trim_feeds(
+                cursor, ALL_USERS, [], options['max_length']
+            )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено записей ленты: {deleted} за {elapsed:.2f} с.'
+        ))
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.16 on 2026-10-17 12:00
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+INDEX_NAME = 'recipe_search_vector_idx'
+
+FILL_SEARCH_VECTOR_SQL = """
+UPDATE api_recipe SET search_vector =
+    setweight(to_tsvector('russian', coalesce(name, '')), 'A')
+    || setweight(to_tsvector('russian', coalesce((
+        SELECT string_agg(ingredient.name, ' ')
+        FROM api_recipeingredient recipe_ingredient
+        JOIN api_ingredient ingredient
+            ON ingredient.id = recipe_ingredient.ingredient_id
+        WHERE recipe_ingredient.recipe_id = api_recipe.id
+    ), '')), 'B')
+    || setweight(to_tsvector('russian', coalesce(text, '')), 'C')
+"""
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(FILL_SEARCH_VECTOR_SQL)
+    schema_editor.execute(
+        f'CREATE INDEX {INDEX_NAME} ON api_recipe '
+        f'USING gin (search_vector)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_recipe_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.16 on 2026-10-17 12:00
+
+import api.models
+from django.db import migrations, models
+
+INDEX_NAME = 'recipe_ingredient_ids_idx'
+
+FILL_INGREDIENT_IDS_SQL = """
+UPDATE api_recipe SET ingredient_ids = ARRAY(
+    SELECT ingredient_id FROM api_recipeingredient
+    WHERE recipe_id = api_recipe.id
+    ORDER BY ingredient_id
+)
+"""
+
+
+def create_ingredient_ids_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(FILL_INGREDIENT_IDS_SQL)
+    schema_editor.execute(
+        f'CREATE INDEX {INDEX_NAME} ON api_recipe '
+        f'USING gin (ingredient_ids)'
+    )
+
+
+def drop_ingredient_ids_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_ids',
+            field=api.models.PostgresArrayField(base_field=models.BigIntegerField(), editable=False, null=True, size=None),
+        ),
+        migrations.RunPython(
+            create_ingredient_ids_index, drop_ingredient_ids_index
+        ),
+    ]
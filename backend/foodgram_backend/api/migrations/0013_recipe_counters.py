@@ -0,0 +1,53 @@
+# Generated by Django 3.2.16 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+FILL_COUNTERS_SQL = [
+    '''
+    UPDATE api_recipe SET
+        favorites_count = (
+            SELECT count(*) FROM api_favorite
+            WHERE recipe_id = api_recipe.id
+        ),
+        carts_count = (
+            SELECT count(*) FROM api_shoppingcart
+            WHERE recipe_id = api_recipe.id
+        )
+    ''',
+    '''
+    UPDATE users_myuser SET
+        recipes_count = (
+            SELECT count(*) FROM api_recipe
+            WHERE author_id = users_myuser.id
+        ),
+        subscribers_count = (
+            SELECT count(*) FROM users_subscription
+            WHERE subscribed_to_id = users_myuser.id
+        )
+    ''',
+]
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_feeditem'),
+        ('users', '0006_myuser_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-created_at', '-id'], name='recipe_popular_idx'),
+        ),
+        migrations.RunSQL(FILL_COUNTERS_SQL, migrations.RunSQL.noop),
+    ]
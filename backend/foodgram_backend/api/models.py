@@ -1,13 +1,44 @@
-from django.db import models
+from django.contrib.postgres.aggregates import ArrayAgg, StringAgg
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+    SearchVectorField,
+)
+from django.db import connections, models
+from django.db.models import (
+    BooleanField,
+    Case,
+    Count,
+    Exists,
+    F,
+    Func,
+    IntegerField,
+    OuterRef,
+    Prefetch,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Substr
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 
+from users.models import CounterFieldsMixin, Subscription
+
 from .constants import (
     MAX_INGRED_LENGTH,
-    MAX_LEN_SL,
     MAX_MU_LENGTH,
     MAX_RN_LENGTH,
-    MAX_TEG_LENGTH
+    MAX_TEG_LENGTH,
+    SEARCH_CONFIG,
+    SEARCH_HEADLINE_LENGTH,
+    SEARCH_HEADLINE_OPTIONS,
+    SHORT_URL_MAX_LENGTH,
 )
 
 User = get_user_model()
@@ -32,12 +63,268 @@ class Ingredient(models.Model):
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_unit'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+class PostgresArrayField(ArrayField):
+    """
+    Массив Postgres. В других СУБД колонка не заполняется,
+    поэтому приведение типа в запросе не добавляется.
+    """
+
+    def get_placeholder(self, value, compiler, connection):
+        if connection.vendor != 'postgresql':
+            return '%s'
+        return super().get_placeholder(value, compiler, connection)
+
+
+INGREDIENTS_MATCHED_SQL = (
+    '(SELECT count(*) FROM unnest({table}.ingredient_ids) AS item '
+    'WHERE item = ANY(%s))'
+)
+
+
+class RecipeQuerySet(models.QuerySet):
+    """
+    Набор запросов рецептов с заранее спланированной выборкой
+    связанных данных и пользовательских флагов.
+    """
+
+    def with_related(self):
+        """
+        Подгружает автора, теги и ингредиенты фиксированным
+        числом запросов независимо от количества рецептов.
+        Служебные поля для поиска для отображения не нужны и не читаются.
+        """
+        return self.defer('search_vector', 'ingredient_ids').select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ),
+            ),
+        )
+
+    def with_user_flags(self, user):
+        """
+        Аннотирует рецепты флагами is_favorited, is_in_shopping_cart
+        и author_is_subscribed для переданного пользователя.
+        """
+        if not user.is_authenticated:
+            false = Value(False, output_field=BooleanField())
+            return self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                author_is_subscribed=false,
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            author_is_subscribed=Exists(
+                Subscription.objects.filter(
+                    subscriber=user, subscribed_to=OuterRef('author')
+                )
+            ),
+        )
+
+    def with_tags(self, tag_ids):
+        """
+        Рецепты хотя бы с одним из тегов. Проверка через EXISTS
+        не соединяет таблицы и не порождает дублей.
+        """
+        return self.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe_id=OuterRef('pk'), tag_id__in=tag_ids
+            )
+        ))
+
+    def for_feed(self, user):
+        """
+        Лента пользователя, аннотированная полями feed_created_at
+        и feed_recipe_id для курсорной пагинации.
+
+        Обычно это чтение записей ленты по индексу
+        (user, -created_at, -recipe). Если пользователь подписан
+        на авторов, чьи рецепты не раскладываются по лентам,
+        их рецепты подмешиваются при чтении.
+        """
+        pulled_authors = list(Subscription.objects.filter(
+            subscriber=user, subscribed_to__fan_out_on_read=True
+        ).values_list('subscribed_to', flat=True))
+        if not pulled_authors:
+            return self.filter(feed_items__user=user).annotate(
+                feed_created_at=F('feed_items__created_at'),
+                feed_recipe_id=F('feed_items__recipe'),
+            )
+        return self.filter(
+            Q(pk__in=FeedItem.objects.filter(user=user).values('recipe'))
+            | Q(author__in=pulled_authors)
+        ).annotate(
+            feed_created_at=F('created_at'),
+            feed_recipe_id=F('id'),
+        )
+
+    def bump_version(self):
+        """
+        Увеличивает версию рецептов, делая устаревшими их
+        закешированные представления.
+        """
+        return self.update(version=F('version') + 1)
+
+    def update_search_vector(self):
+        """
+        Пересчитывает поисковый вектор: название (вес A),
+        ингредиенты (B) и описание (C). Вне Postgres ничего не делает.
+        """
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        ingredient_names = RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', delimiter=' ')
+        ).values('names')
+        return self.update(
+            search_vector=(
+                SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                + SearchVector(
+                    Subquery(ingredient_names),
+                    weight='B',
+                    config=SEARCH_CONFIG,
+                )
+                + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+            )
+        )
+
+    def update_ingredient_ids(self):
+        """
+        Пересчитывает массив id ингредиентов рецепта, который служит
+        обратным индексом ингредиент -> рецепты. Вне Postgres
+        ничего не делает.
+        """
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        ingredient_ids = RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            ids=ArrayAgg('ingredient_id', ordering='ingredient_id')
+        ).values('ids')
+        return self.update(ingredient_ids=Subquery(ingredient_ids))
+
+    def with_ingredients(self, ingredient_ids, max_missing=0):
+        """
+        Рецепты, которые можно приготовить из переданных ингредиентов,
+        если докупить не больше max_missing недостающих.
+        Аннотирует рецепты полем ingredients_missing и сортирует
+        по нему, затем по числу совпавших ингредиентов.
+        """
+        have = sorted(set(ingredient_ids))
+        if connections[self.db].vendor != 'postgresql':
+            return self.with_ingredients_by_join(have, max_missing)
+        if max_missing:
+            queryset = self.filter(ingredient_ids__overlap=have)
+        else:
+            queryset = self.filter(ingredient_ids__contained_by=have)
+        matched = RawSQL(
+            INGREDIENTS_MATCHED_SQL.format(table=self.model._meta.db_table),
+            (have,),
+            output_field=IntegerField(),
+        )
+        total = Func(
+            F('ingredient_ids'),
+            function='cardinality',
+            output_field=IntegerField(),
+        )
+        return queryset.annotate(
+            ingredients_matched=matched,
+            ingredients_missing=total - matched,
+        ).filter(
+            ingredients_missing__lte=max_missing
+        ).order_by(
+            'ingredients_missing', '-ingredients_matched',
+            '-created_at', '-id',
+        )
+
+    def with_ingredients_by_join(self, have, max_missing):
+        """
+        Запасной вариант для SQLite: подсчет через соединение
+        с ингредиентами рецепта.
+        """
+        return self.annotate(
+            ingredients_total=Count('recipe_ingredients', distinct=True),
+            ingredients_matched=Count(
+                'recipe_ingredients',
+                filter=Q(recipe_ingredients__ingredient__in=have),
+                distinct=True,
+            ),
+        ).annotate(
+            ingredients_missing=(
+                F('ingredients_total') - F('ingredients_matched')
+            ),
+        ).filter(
+            ingredients_matched__gt=0,
+            ingredients_missing__lte=max_missing,
+        ).order_by(
+            'ingredients_missing', '-ingredients_matched',
+            '-created_at', '-id',
+        )
+
+    def search(self, text):
+        """
+        Полнотекстовый поиск с сортировкой по релевантности.
+        Аннотирует рецепты полями search_rank и search_headline.
+        Вне Postgres используется поиск по подстроке.
+        """
+        if connections[self.db].vendor != 'postgresql':
+            return self.search_by_substring(text)
+        query = SearchQuery(
+            text, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return self.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query),
+            search_headline=SearchHeadline(
+                'text', query, config=SEARCH_CONFIG,
+                **SEARCH_HEADLINE_OPTIONS,
+            ),
+        ).order_by('-search_rank', '-created_at', '-id')
+
+    def search_by_substring(self, text):
+        """
+        Запасной поиск для SQLite: совпадение в названии важнее
+        совпадения в ингредиентах и описании.
+        """
+        in_name = Q(name__icontains=text)
+        in_ingredients = Exists(RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk'), ingredient__name__icontains=text
+        ))
+        return self.filter(
+            in_name | in_ingredients | Q(text__icontains=text)
+        ).annotate(
+            search_rank=Case(
+                When(in_name, then=Value(2)),
+                When(in_ingredients, then=Value(1)),
+                default=Value(0),
+                output_field=IntegerField(),
+            ),
+            search_headline=Substr('text', 1, SEARCH_HEADLINE_LENGTH),
+        ).order_by('-search_rank', '-created_at', '-id')
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -51,6 +338,7 @@ class Recipe(models.Model):
         blank=False,
         upload_to='recipes/images/'
     )
+    image_variants = models.JSONField(default=dict, blank=True)
     tags = models.ManyToManyField(Tag, related_name='recipes')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -58,15 +346,38 @@ class Recipe(models.Model):
         related_name='recipes'
     )
     short_url = models.CharField(
-        max_length=MAX_LEN_SL,
+        max_length=SHORT_URL_MAX_LENGTH,
         unique=True,
         blank=True,
         null=True
     )
+    created_at = models.DateTimeField(auto_now_add=True)
+    version = models.PositiveIntegerField(default=0, editable=False)
+    favorites_count = models.PositiveIntegerField(default=0, editable=False)
+    carts_count = models.PositiveIntegerField(default=0, editable=False)
+    counter_fields = ('version', 'favorites_count', 'carts_count')
+    # GIN-индексы по служебным полям создаются миграциями только в Postgres.
+    search_vector = SearchVectorField(null=True, editable=False)
+    ingredient_ids = PostgresArrayField(
+        models.BigIntegerField(), null=True, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        ordering = ('-created_at', '-id')
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='recipe_created_at_id_idx',
+            ),
+            models.Index(
+                fields=['-favorites_count', '-created_at', '-id'],
+                name='recipe_popular_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -161,3 +472,164 @@ class ShoppingCart(models.Model):
         return (
             f'{self.user.username} добавил {self.recipe.name} в список покупок'
         )
+
+
+class FeedItem(models.Model):
+    """
+    Рецепт в ленте подписчика. Заполняется при публикации рецепта,
+    created_at копируется из рецепта для сортировки ленты.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items'
+    )
+    created_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_item'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-created_at', '-recipe'],
+                name='feed_item_user_created_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe.name} в ленте {self.user.username}'
+
+
+class SimilarRecipe(models.Model):
+    """
+    Похожий рецепт по совместному добавлению в избранное
+    и список покупок. Заполняется командой build_recommendations.
+    """
+    # Поиск по рецепту покрывают составные индексы ниже.
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        db_index=False,
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    score = models.FloatField()
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['recipe', '-score'],
+                name='similar_recipe_score_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.similar.name} похож на {self.recipe.name}'
+
+
+class RecommendationBuild(models.Model):
+    """
+    Запуск build_recommendations. Последние обработанные id избранного
+    и списка покупок нужны для инкрементального обновления.
+    """
+    finished_at = models.DateTimeField(auto_now_add=True)
+    last_favorite_id = models.BigIntegerField()
+    last_cart_id = models.BigIntegerField()
+    recipes = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = 'Расчет рекомендаций'
+        verbose_name_plural = 'Расчеты рекомендаций'
+        ordering = ('-finished_at',)
+
+    def __str__(self):
+        return f'Расчет рекомендаций {self.finished_at:%Y-%m-%d %H:%M}'
+
+
+class RecipeSignature(models.Model):
+    """
+    MinHash-подпись набора ингредиентов рецепта.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='signature'
+    )
+    signature = models.BinaryField()
+
+    class Meta:
+        verbose_name = 'Подпись ингредиентов'
+        verbose_name_plural = 'Подписи ингредиентов'
+
+    def __str__(self):
+        return f'Подпись рецепта {self.recipe_id}'
+
+
+class RecipeBand(models.Model):
+    """
+    Корзина LSH: полоса подписи рецепта и хеш ее значений.
+    Рецепты с совпавшей корзиной - кандидаты в похожие.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    band = models.PositiveSmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        verbose_name = 'Корзина LSH'
+        verbose_name_plural = 'Корзины LSH'
+        indexes = [
+            # recipe в индексе позволяет искать кандидатов
+            # без чтения таблицы.
+            models.Index(
+                fields=['band', 'bucket', 'recipe'],
+                name='recipe_band_bucket_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'Полоса {self.band} рецепта {self.recipe_id}'
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Позиция в файле import_recipes, до которой рецепты уже загружены.
+    Обновляется в транзакции пачки, поэтому сбой не повторяет пачку.
+    """
+    name = models.CharField(max_length=MAX_RN_LENGTH, unique=True)
+    offset = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Контрольная точка загрузки'
+        verbose_name_plural = 'Контрольные точки загрузки'
+
+    def __str__(self):
+        return f'{self.name}: {self.offset}'
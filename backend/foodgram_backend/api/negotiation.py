@@ -0,0 +1,10 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class IgnoreFormatContentNegotiation(DefaultContentNegotiation):
+    """
+    Не использует параметр format для выбора рендерера:
+    в выгрузках он определяет формат файла, а не ответа API.
+    """
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
@@ -1,27 +1,313 @@
+import base64
+import hashlib
+import json
+import re
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from .constants import (
+    COUNT_CACHE_TTL,
+    COUNT_ESTIMATE_THRESHOLD,
+    COUNT_STRATEGY_HEADER,
     DEF_PAGE_SIZE,
     MAX_PAGE_SIZE
 )
 
+# Таблицы, из которых читает запрос подсчета.
+COUNT_TABLES = re.compile(r'(?:FROM|JOIN)\s+"([^"]+)"')
+
+
+def get_count_version_key(table):
+    return f'pagination_count_version:{table}'
+
+
+def invalidate_counts(model):
+    """
+    Сбрасывает закешированные количества, зависящие от таблицы модели.
+    """
+    key = get_count_version_key(model._meta.db_table)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+class ExactCount:
+    """
+    Точный подсчет через SELECT COUNT(*).
+    """
+    name = 'exact'
+
+    def get_count(self, queryset):
+        return self.name, queryset.count()
+
+
+class CachedCount(ExactCount):
+    """
+    Точный подсчет, закешированный на COUNT_CACHE_TTL секунд.
+    Ключ строится по SQL одних фильтров, без аннотаций и сортировки:
+    флаги текущего пользователя и ранг поиска на количество
+    не влияют, и один набор фильтров дает один ключ для всех.
+    В ключ входят версии таблиц, которые читает запрос, поэтому
+    запись в избранное сбрасывает только количества с фильтром
+    по избранному. Версии меняются сигналами при создании
+    и удалении объектов.
+    """
+    name = 'cached'
+
+    def get_cache_key(self, queryset):
+        query = queryset.values('pk').order_by().query
+        sql, params = query.sql_with_params()
+        version_keys = [
+            get_count_version_key(table)
+            for table in sorted(set(COUNT_TABLES.findall(sql)))
+        ]
+        versions = cache.get_many(version_keys)
+        for key in version_keys:
+            if key not in versions:
+                cache.add(key, 1, None)
+                versions[key] = 1
+        digest = hashlib.md5(
+            f'{sql}{params!r}{sorted(versions.items())!r}'.encode()
+        ).hexdigest()
+        return f'pagination_count:{queryset.model._meta.label_lower}:{digest}'
+
+    def get_count(self, queryset):
+        key = self.get_cache_key(queryset)
+        count = cache.get(key)
+        if count is not None:
+            return CachedCount.name, count
+        count = queryset.count()
+        cache.set(key, count, COUNT_CACHE_TTL)
+        return ExactCount.name, count
+
+
+class EstimatedCount(CachedCount):
+    """
+    Оценка количества по статистике Postgres: reltuples для запросов
+    без фильтров и оценка планировщика (EXPLAIN) для остальных.
+    Небольшие выборки и другие СУБД считаются точно с кешем.
+    """
+    name = 'estimated'
+
+    def estimate(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        queryset = queryset.order_by()
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+                return row[0] if row and row[0] >= 0 else None
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return plan[0]['Plan']['Plan Rows']
+
+    def get_count(self, queryset):
+        estimate = self.estimate(queryset)
+        if estimate is None or estimate < COUNT_ESTIMATE_THRESHOLD:
+            return super().get_count(queryset)
+        return self.name, estimate
+
+
+COUNT_STRATEGIES = {
+    strategy.name: strategy
+    for strategy in (ExactCount, CachedCount, EstimatedCount)
+}
+
+
+class CountingPaginator(Paginator):
+    """
+    Paginator, получающий количество объектов от стратегии подсчета.
+    """
+    def __init__(self, object_list, per_page, strategy, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.strategy = strategy
+        self.strategy_name = None
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        self.strategy_name, count = self.strategy.get_count(
+            self.object_list
+        )
+        return count
+
 
 class CustomPagination(PageNumberPagination):
     """
     Кастомный класс пагинации для настройки количества объектов на странице.
+
+    При наличии параметра cursor включается keyset-пагинация
+    по паре (created_at, id): без COUNT(*) и OFFSET, поэтому
+    глубокие страницы стоят столько же, сколько первая.
+    Другую пару полей можно задать атрибутом cursor_fields у view,
+    а view с атрибутом cursor_pagination всегда листается курсором.
+    Запрос с другой сортировкой (популярность, релевантность поиска)
+    курсором не листается: курсор хранит позицию только по этой паре.
+
+    Стратегия подсчета общего количества задается атрибутом
+    count_strategy у view (exact, cached или estimated).
     """
     page_size = DEF_PAGE_SIZE
     page_size_query_param = 'limit'
     max_page_size = MAX_PAGE_SIZE
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+    cursor_ordering_message = (
+        'Курсор нельзя использовать вместе с другой сортировкой.'
+    )
+    count_strategy = ExactCount.name
+    cursor_fields = ('created_at', 'id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_strategy = getattr(
+            view, 'count_strategy', self.count_strategy
+        )
+        self.cursor_fields = getattr(
+            view, 'cursor_fields', self.cursor_fields
+        )
+        self.cursor_mode = (
+            self.cursor_query_param in request.query_params
+            or getattr(view, 'cursor_pagination', False)
+        )
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_queryset_by_cursor(queryset, request)
+
+    def django_paginator_class(self, object_list, per_page):
+        """
+        Создает Paginator с выбранной для view стратегией подсчета.
+        """
+        return CountingPaginator(
+            object_list, per_page, COUNT_STRATEGIES[self.count_strategy](),
+        )
+
+    def paginate_queryset_by_cursor(self, queryset, request):
+        """
+        Возвращает страницу после (или перед) позицией из курсора.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+        date_field, id_field = self.cursor_fields
+        if queryset.query.order_by and tuple(queryset.query.order_by) not in (
+            (f'-{date_field}', f'-{id_field}'), (date_field, id_field),
+        ):
+            raise ValidationError(
+                {self.cursor_query_param: self.cursor_ordering_message}
+            )
+        if reverse:
+            queryset = queryset.order_by(date_field, id_field)
+            lookup = 'gt'
+        else:
+            queryset = queryset.order_by(f'-{date_field}', f'-{id_field}')
+            lookup = 'lt'
+        if position:
+            queryset = queryset.filter(
+                Q(**{f'{date_field}__{lookup}': position[0]})
+                | Q(**{
+                    date_field: position[0],
+                    f'{id_field}__{lookup}': position[1],
+                })
+            )
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            has_next, has_previous = position is not None, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+        self.next_position = (
+            self.get_position(results[-1]) if has_next and results else None
+        )
+        self.previous_position = (
+            self.get_position(results[0])
+            if has_previous and results else None
+        )
+        return results
+
+    def get_position(self, obj):
+        date_field, id_field = self.cursor_fields
+        return getattr(obj, date_field).isoformat(), getattr(obj, id_field)
+
+    def decode_cursor(self, request):
+        """
+        Разбирает курсор вида base64({"p": [created_at, id], "r": bool}).
+        Пустой курсор означает первую страницу.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position = cursor['p']
+            created_at = parse_datetime(position[0])
+            if created_at is None:
+                raise ValueError
+            return (created_at, int(position[1])), bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position, reverse):
+        cursor = json.dumps({'p': position, 'r': reverse})
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url,
+            self.cursor_query_param,
+            base64.urlsafe_b64encode(cursor.encode()).decode(),
+        )
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, True)
 
     def get_paginated_response(self, data):
         """
         Возвращает ответ с пагинацией.
+        В режиме курсора общее количество не считается.
         """
-        return Response({
-            'count': self.page.paginator.count,
+        if self.cursor_mode:
+            count, strategy = None, 'none'
+        else:
+            paginator = self.page.paginator
+            count = paginator.count
+            strategy = getattr(paginator, 'strategy_name', None) or 'exact'
+        response = Response({
+            'count': count,
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
             'results': data,
         })
+        response[COUNT_STRATEGY_HEADER] = strategy
+        return response
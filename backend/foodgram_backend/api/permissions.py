@@ -44,6 +44,6 @@ class IsAuthorOrAdminOrReadOnly(permissions.BasePermission):
         """
         return (
             request.method in permissions.SAFE_METHODS
-            or obj.author == request.user
+            or obj.author_id == request.user.pk
             or request.user.is_staff
         )
@@ -0,0 +1,129 @@
+from itertools import islice
+
+import numpy as np
+from django.db import connection, transaction
+from scipy import sparse
+
+from .models import SimilarRecipe
+
+INSERT_SQL = '''
+    INSERT INTO {table} (recipe_id, similar_id, score)
+    SELECT * FROM unnest(%s::bigint[], %s::bigint[], %s::double precision[])
+'''
+
+
+def load_pairs(queryset, read_size):
+    """
+    Читает пары (user_id, recipe_id) порциями курсора в массив numpy,
+    не создавая объектов моделей.
+    """
+    rows = queryset.order_by().values_list('user_id', 'recipe_id').iterator(
+        chunk_size=read_size
+    )
+    chunks = []
+    while True:
+        chunk = list(islice(rows, read_size))
+        if not chunk:
+            break
+        chunks.append(np.array(chunk, dtype=np.int64))
+    if not chunks:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.concatenate(chunks)
+
+
+def build_matrix(sources):
+    """
+    Собирает матрицу пользователь x рецепт из пар с весами
+    [(pairs, weight), ...] и нормирует столбцы, чтобы произведение
+    столбцов давало косинусную близость рецептов. Повторные пары
+    (рецепт и в избранном, и в покупках) складываются.
+    Возвращает матрицу CSR и массив id рецептов по столбцам.
+    """
+    pairs = np.concatenate([pairs for pairs, _ in sources])
+    weights = np.concatenate([
+        np.full(len(pairs), weight, dtype=np.float32)
+        for pairs, weight in sources
+    ])
+    _, user_index = np.unique(pairs[:, 0], return_inverse=True)
+    recipe_ids, recipe_index = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (weights, (user_index, recipe_index)),
+        shape=(user_index.max(initial=-1) + 1, len(recipe_ids)),
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)))
+    norms = norms.ravel()
+    norms[norms == 0] = 1
+    return (matrix @ sparse.diags(1 / norms)).tocsr(), recipe_ids
+
+
+def find_related(matrix, columns, chunk_size):
+    """
+    Столбцы columns и все столбцы с ненулевой близостью к ним.
+    Изменение столбца меняет его оценки со всеми такими рецептами,
+    поэтому их top_k тоже нужно пересчитать.
+    """
+    items = matrix.T.tocsr()
+    related = [np.asarray(columns, dtype=np.int64)]
+    for start in range(0, len(columns), chunk_size):
+        chunk = columns[start:start + chunk_size]
+        related.append((items[chunk] @ matrix).tocsr().indices)
+    return np.unique(np.concatenate(related))
+
+
+def iter_neighbours(matrix, columns, top_k, chunk_size):
+    """
+    Ищет для столбцов columns top_k ближайших по косинусу.
+    Близость считается блоками по chunk_size рецептов, поэтому память
+    ограничена размером блока. Для каждого блока возвращает
+    (столбцы блока, строки, соседи, оценки), где строки, соседи
+    и оценки - плоские массивы пар, по убыванию оценки для столбца.
+    """
+    items = matrix.T.tocsr()
+    for start in range(0, len(columns), chunk_size):
+        chunk = columns[start:start + chunk_size]
+        block = (items[chunk] @ matrix).tocsr()
+        rows, neighbours, scores = [], [], []
+        for row, column in enumerate(chunk):
+            begin, end = block.indptr[row], block.indptr[row + 1]
+            similar = block.indices[begin:end]
+            score = block.data[begin:end]
+            keep = similar != column
+            similar, score = similar[keep], score[keep]
+            if len(score) > top_k:
+                top = np.argpartition(-score, top_k)[:top_k]
+                similar, score = similar[top], score[top]
+            order = np.argsort(-score, kind='stable')
+            rows.append(np.full(len(order), column))
+            neighbours.append(similar[order])
+            scores.append(score[order])
+        yield (
+            chunk,
+            np.concatenate(rows),
+            np.concatenate(neighbours),
+            np.concatenate(scores),
+        )
+
+
+@transaction.atomic
+def save_neighbours(recipe_ids, recipes, similar, scores):
+    """
+    Заменяет похожие рецепты для recipe_ids тройками из массивов
+    recipes, similar и scores. В Postgres пишет одним INSERT из unnest,
+    без создания объектов моделей.
+    """
+    SimilarRecipe.objects.filter(recipe_id__in=recipe_ids.tolist()).delete()
+    if not len(recipes):
+        return
+    if connection.vendor != 'postgresql':
+        SimilarRecipe.objects.bulk_create(
+            SimilarRecipe(recipe_id=recipe, similar_id=other, score=score)
+            for recipe, other, score in zip(
+                recipes.tolist(), similar.tolist(), scores.tolist()
+            )
+        )
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            INSERT_SQL.format(table=SimilarRecipe._meta.db_table),
+            [recipes.tolist(), similar.tolist(), scores.tolist()],
+        )
@@ -1,9 +1,24 @@
+import json
+
 from django.contrib.auth.password_validation import validate_password
+from django.db import transaction
+from django.db.models import Manager, Prefetch, prefetch_related_objects
+from django.http import QueryDict
 
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
 from djoser.serializers import UserCreateSerializer, UserSerializer
 
+from .authentication import revoke_refresh_tokens
+from .constants import BULK_MAX_IDS, LIST_IMAGE_VARIANT
+from .fields import Base64OrFileImageField, PrimaryKeyListField
+from .fragments import get_fragment_key, get_fragments, set_fragments
+from .images import get_variant_urls
 from .models import Ingredient, Recipe, RecipeIngredient, Tag
 from users.models import MyUser, Subscription
 
@@ -56,6 +71,8 @@ class UserProfileSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return Subscription.objects.filter(
@@ -68,12 +85,31 @@ class AvatarSerializer(serializers.ModelSerializer):
     """
     Сериализатор для аватара пользователя.
     """
-    avatar = Base64ImageField(required=True, allow_null=True)
+    avatar = Base64OrFileImageField(required=True, allow_null=True)
 
     class Meta:
         model = MyUser
         fields = ('avatar',)
 
+    def update(self, instance, validated_data):
+        instance.avatar = validated_data['avatar']
+        instance.save(update_fields=['avatar'])
+        return instance
+
+
+class IdListSerializer(serializers.Serializer):
+    """
+    Список id для пакетных операций: {"ids": [1, 2, 3]}.
+    """
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_MAX_IDS,
+    )
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
 
 class PasswordChangeSerializer(serializers.Serializer):
     """
@@ -93,7 +129,39 @@ class PasswordChangeSerializer(serializers.Serializer):
     def save(self, **kwargs):
         user = self.context['request'].user
         user.set_password(self.validated_data['new_password'])
-        user.save()
+        user.save(update_fields=['password'])
+        revoke_refresh_tokens(user.pk)
+
+
+class JWTObtainSerializer(TokenObtainPairSerializer):
+    """
+    Выдает пару JWT по email и паролю. В токены кладется is_staff,
+    чтобы права проверялись без обращения к базе.
+    """
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['is_staff'] = user.is_staff
+        return token
+
+
+class JWTRefreshSerializer(TokenRefreshSerializer):
+    """
+    Обменивает refresh-токен на новую пару. Старый токен отзывается,
+    флаги пользователя перечитываются из базы.
+    """
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user = MyUser.objects.filter(
+            pk=refresh[api_settings.USER_ID_CLAIM], is_active=True
+        ).first()
+        if user is None:
+            raise AuthenticationFailed(
+                'Пользователь не найден или неактивен.'
+            )
+        refresh.blacklist()
+        refresh = JWTObtainSerializer.get_token(user)
+        return {'access': str(refresh.access_token), 'refresh': str(refresh)}
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -115,8 +183,11 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
-
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    """
+    Ингредиент в запросе на создание рецепта. Существование
+    ингредиентов проверяется одним запросом в CreateRecipeSerializer.
+    """
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredient
@@ -159,11 +230,32 @@ class RecipeIngredientSerializer(serializers.Serializer):
         return value
 
 
+# Аннотации поиска, которые добавляются к ответу, если они есть.
+REQUEST_FIELDS = ('search_headline', 'ingredients_missing')
+# Счетчики меняются часто, поэтому в кеш представления не входят.
+COUNTER_FIELDS = ('favorites_count', 'carts_count')
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """
+    Список рецептов: общие представления читаются из кеша
+    одним запросом на всю страницу.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, Manager) else data
+        return self.child.to_representation_many(iterable)
+
+
 class RecipeSerializer(serializers.ModelSerializer):
     """
     Сериализатор для отображения списка рецептов.
+
+    Представление без пользовательских полей кешируется по id
+    и версии рецепта, а is_favorited, is_in_shopping_cart
+    и author.is_subscribed подставляются для каждого запроса.
     """
-    image = Base64ImageField(required=True, allow_null=False)
+    image = Base64OrFileImageField(required=True, allow_null=False)
     author = UserProfileSerializer()
     tags = TagSerializer(many=True)
     is_favorited = serializers.SerializerMethodField()
@@ -171,22 +263,28 @@ class RecipeSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientSerializer(
         many=True, source='recipe_ingredients'
     )
+    images = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'name', 'tags',
-            'text', 'image', 'author',
+            'text', 'image', 'images', 'author',
             'cooking_time', 'is_favorited',
             'is_in_shopping_cart', 'ingredients',
+            'favorites_count', 'carts_count',
         )
         read_only_fields = (
             'tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+            'favorites_count', 'carts_count',
         )
+        list_serializer_class = RecipeListSerializer
 
     def __init__(self, *args, **kwargs):
         fields = kwargs.pop('fields', None)
         super().__init__(*args, **kwargs)
+        # Урезанный набор полей в общий кеш не попадает.
+        self.use_fragments = not fields
         if fields:
             allowed = set(fields)
             existing = set(self.fields.keys())
@@ -204,13 +302,98 @@ class RecipeSerializer(serializers.ModelSerializer):
         ingredients = RecipeIngredient.objects.filter(recipe=obj.id)
         return RecipeIngredientSerializer(ingredients, many=True).data
 
+    def to_representation(self, instance):
+        return self.to_representation_many([instance])[0]
+
+    def to_representation_many(self, instances):
+        """
+        Собирает представления рецептов: общая часть берется из кеша
+        или строится заново, поверх нее кладутся флаги пользователя.
+        """
+        if not self.use_fragments:
+            return [
+                self.build_representation(instance)
+                for instance in instances
+            ]
+        keys = [
+            get_fragment_key(instance, self.context)
+            for instance in instances
+        ]
+        fragments = get_fragments(keys)
+        missing = {}
+        result = []
+        for instance, key in zip(instances, keys):
+            if key not in fragments:
+                fragments[key] = missing[key] = self.build_representation(
+                    instance
+                )
+            result.append(self.add_user_flags(instance, fragments[key]))
+        set_fragments(missing)
+        return result
+
+    def build_representation(self, instance):
+        """
+        Передает аннотацию подписки на автора во вложенный сериализатор.
+        """
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        data = super().to_representation(instance)
+        variant = self.context.get('image_variant')
+        if variant and 'image' in data:
+            data['image'] = get_variant_urls(
+                instance, self.context.get('request')
+            ).get(variant, {}).get('jpeg', data['image'])
+        return data
+
+    def add_user_flags(self, instance, fragment):
+        """
+        Копирует общее представление и подставляет в него флаги
+        текущего пользователя, счетчики и поля, зависящие от запроса:
+        фрагмент найденного текста и число недостающих ингредиентов.
+        """
+        data = dict(fragment)
+        for field in REQUEST_FIELDS:
+            if hasattr(instance, field):
+                data[field] = getattr(instance, field)
+        for field in COUNTER_FIELDS:
+            if field in data:
+                data[field] = getattr(instance, field)
+        if 'is_favorited' in data:
+            data['is_favorited'] = self.get_is_favorited(instance)
+        if 'is_in_shopping_cart' in data:
+            data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(
+                instance
+            )
+        if 'author' in data:
+            data['author'] = dict(
+                data['author'],
+                is_subscribed=self.get_author_is_subscribed(instance),
+            )
+        return data
+
+    def get_author_is_subscribed(self, obj):
+        if hasattr(obj, 'author_is_subscribed'):
+            return obj.author_is_subscribed
+        return self.fields['author'].get_is_subscribed(obj.author)
+
+    def get_images(self, obj):
+        """
+        Уменьшенные копии изображения: {вариант: {формат: url}}.
+        Пока варианты не готовы, возвращается пустой словарь.
+        """
+        return get_variant_urls(obj, self.context.get('request'))
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
         return user.favorites.filter(recipe=obj.id).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
@@ -232,13 +415,9 @@ class CreateRecipeSerializer(RecipeSerializer):
             'cooking_time',
         )
 
-    image = Base64ImageField(required=True, allow_null=False)
+    image = Base64OrFileImageField(required=True, allow_null=False)
     ingredients = RecipeIngredientCreateSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
-        read_only=False,
-    )
+    tags = PrimaryKeyListField(queryset=Tag.objects.all())
     author = serializers.PrimaryKeyRelatedField(
         read_only=True,
         default=serializers.CurrentUserDefault(),
@@ -251,6 +430,29 @@ class CreateRecipeSerializer(RecipeSerializer):
             )
         return value
 
+    def to_internal_value(self, data):
+        """
+        В multipart/form-data ингредиенты и теги можно передать
+        JSON-строкой рядом с файлом изображения.
+        """
+        if isinstance(data, QueryDict):
+            tags = data.getlist('tags')
+            data = data.dict()
+            if len(tags) == 1 and tags[0].startswith('['):
+                tags = tags[0]
+            if tags:
+                data['tags'] = tags
+            for field in ('ingredients', 'tags'):
+                if not isinstance(data.get(field), str):
+                    continue
+                try:
+                    data[field] = json.loads(data[field])
+                except ValueError:
+                    raise serializers.ValidationError(
+                        {field: ['Ожидается JSON.']}
+                    )
+        return super().to_internal_value(data)
+
     def validate_tags(self, value):
         tags = []
         if not value:
@@ -271,6 +473,16 @@ class CreateRecipeSerializer(RecipeSerializer):
                     'Этот ингредиент уже добавлен.'
                 )
             ingredients.append(ingredient.get('id'))
+        missing = set(ingredients) - set(
+            Ingredient.objects.filter(
+                id__in=ingredients
+            ).values_list('id', flat=True)
+        )
+        if missing:
+            missing = ', '.join(map(str, sorted(missing)))
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {missing}.'
+            )
         return value
 
     def validate_cooking_time(self, value):
@@ -285,13 +497,45 @@ class CreateRecipeSerializer(RecipeSerializer):
 
     @staticmethod
     def create_ingredients(ingredients, recipe):
-        for ingredient_data in ingredients:
-            RecipeIngredient.objects.create(
-                ingredient=ingredient_data.pop('id'),
-                amount=ingredient_data.pop('amount'),
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
                 recipe=recipe,
+                ingredient_id=ingredient_data['id'],
+                amount=ingredient_data['amount'],
             )
+            for ingredient_data in ingredients
+        )
+
+    @staticmethod
+    def update_ingredients(ingredients, recipe):
+        """
+        Приводит ингредиенты рецепта к переданным, изменяя только
+        отличающиеся строки: удаление, обновление и вставка пачками.
+        """
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        existing = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in recipe.recipe_ingredients.all()
+        }
+        removed = existing.keys() - amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        changed = []
+        for ingredient_id, recipe_ingredient in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        CreateRecipeSerializer.create_ingredients(
+            [item for item in ingredients if item['id'] not in existing],
+            recipe,
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         author = self.context.get('request').user
         ingredients = validated_data.pop('ingredients')
@@ -299,8 +543,13 @@ class CreateRecipeSerializer(RecipeSerializer):
         recipe = Recipe.objects.create(author=author, **validated_data)
         recipe.tags.set(tags)
         self.create_ingredients(ingredients, recipe)
+        # Новый рецепт еще никто не добавил, а на себя подписаться нельзя.
+        recipe.is_favorited = False
+        recipe.is_in_shopping_cart = False
+        recipe.author_is_subscribed = False
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients', [])
         tags = validated_data.pop('tags', [])
@@ -309,16 +558,29 @@ class CreateRecipeSerializer(RecipeSerializer):
             raise serializers.ValidationError(
                 'Ингредиенты или теги не указаны.'
             )
-        instance.tags.clear()
-        instance.ingredients.clear()
+        instance = super().update(instance, validated_data)
         instance.tags.set(tags)
-        self.create_ingredients(ingredients, instance)
+        self.update_ingredients(ingredients, instance)
         return instance
 
     def to_representation(self, instance):
+        """
+        Ответ на запись строится заново: версия рецепта в памяти
+        уже устарела, и читать по ней кеш нельзя.
+        """
+        prefetch_related_objects(
+            [instance],
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ),
+            ),
+        )
         return RecipeSerializer(
-            instance, context={'request': self.context.get('request')},
-        ).data
+            context={'request': self.context.get('request')},
+        ).build_representation(instance)
 
 
 class SubscriptionCreateSerializer(serializers.ModelSerializer):
@@ -328,6 +590,8 @@ class SubscriptionCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscription
         fields = ('subscriber', 'subscribed_to')
+        # Повторную подписку отсекает уникальное ограничение в базе.
+        validators = []
 
     def create(self, validated_data):
         subscriber = validated_data['subscriber']
@@ -345,19 +609,51 @@ class SubscriptionCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Нельзя подписаться на самого себя.'
             )
-        if Subscription.objects.filter(
-            subscriber=subscriber, subscribed_to=subscribed_to,
-        ).exists():
-            raise serializers.ValidationError(
-                'Вы уже подписаны на этого пользователя.'
-            )
         return data
 
     def to_representation(self, instance):
+        request = self.context['request']
+        instance = Subscription.objects.for_subscriber(
+            request.user, self.context.get('recipes_limit'),
+        ).get(pk=instance.pk)
         return SubscriptionSerializer(instance, context=self.context).data
 
 
+class RecipeShortSerializer(serializers.ModelSerializer):
+    """
+    Краткое представление рецепта.
+    """
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Recipe
+        fields = ('id', 'name', 'image', 'cooking_time')
+
+    def get_image(self, obj):
+        request = self.context.get('request')
+        card = get_variant_urls(obj, request).get(LIST_IMAGE_VARIANT, {})
+        if 'jpeg' in card:
+            return card['jpeg']
+        url = obj.image.url
+        return request.build_absolute_uri(url) if request else url
+
+
+class SimilarRecipeSerializer(RecipeShortSerializer):
+    """
+    Похожий рецепт с оценкой близости, принимает SimilarRecipe.
+    """
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance.similar)
+        data['score'] = round(instance.score, 4)
+        return data
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор автора на странице подписок. Ожидает подписки,
+    полученные через Subscription.objects.for_subscriber().
+    """
     email = serializers.EmailField(
         source='subscribed_to.email',
         read_only=True
@@ -376,10 +672,10 @@ class SubscriptionSerializer(serializers.ModelSerializer):
     avatar = serializers.ImageField(
         source='subscribed_to.avatar', read_only=True,
     )
-    recipes_count = serializers.IntegerField(
-        source='subscribed_to.recipes.count', read_only=True,
+    recipes_count = serializers.IntegerField(read_only=True)
+    recipes = RecipeShortSerializer(
+        source='subscribed_to.recipe_previews', many=True, read_only=True,
     )
-    recipes = serializers.SerializerMethodField()
 
     class Meta:
         model = Subscription
@@ -388,33 +684,11 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             'is_subscribed', 'recipes', 'recipes_count', 'avatar',
         )
 
-    def get_recipes(self, obj):
-        request = self.context['request']
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.subscribed_to.recipes.all()
-        if limit:
-            try:
-                limit = int(limit)
-            except ValueError:
-                raise serializers.ValidationError(
-                    'recipes_limit должен быть числом.'
-                )
-            recipes = recipes[:limit]
-        return RecipeSerializer(
-            recipes, many=True, context=self.context,
-            fields=('id', 'name', 'image', 'cooking_time'),
-        ).data
-
-    def get_recipes_count(self, obj):
-        return obj.subscribed_to.recipes.count()
-
     def get_is_subscribed(self, obj):
         """
-        Проверяет, подписан ли текущий пользователь на данного пользователя.
+        Подписки всегда принадлежат текущему пользователю.
         """
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        return Subscription.objects.filter(
-            subscriber=request.user, subscribed_to=obj.subscribed_to,
-        ).exists()
+        return obj.subscriber_id == request.user.id
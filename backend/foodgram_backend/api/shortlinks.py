@@ -0,0 +1,104 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from hashids import Hashids
+
+from .constants import (
+    MAX_LEN_SL,
+    SHORT_URL_CACHE_SIZE,
+    SHORT_URL_KNOWN_TTL,
+    SHORT_URL_NEGATIVE_TTL,
+)
+from .models import Recipe
+
+hashids = Hashids(min_length=MAX_LEN_SL, salt="your_secret_salt")
+
+
+def encode(recipe_id):
+    return hashids.encode(recipe_id)
+
+
+def decode(short_url):
+    """
+    Возвращает id рецепта по короткому коду или None.
+    Неканонические коды (другая запись того же id) не принимаются.
+    """
+    decoded = hashids.decode(short_url)
+    if len(decoded) != 1 or hashids.encode(decoded[0]) != short_url:
+        return None
+    return decoded[0]
+
+
+class BoundedCache:
+    """
+    Потокобезопасный LRU-кеш ограниченного размера с TTL.
+    """
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            expires = self.data.get(key)
+            if expires is None:
+                return False
+            if expires and expires < time.monotonic():
+                del self.data[key]
+                return False
+            self.data.move_to_end(key)
+            return True
+
+    def add(self, key):
+        with self.lock:
+            self.data[key] = (
+                time.monotonic() + self.ttl if self.ttl else 0
+            )
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+
+# Удаление рецепта сбрасывает код сигналом только в своем процессе,
+# в остальных известный рецепт перепроверяется через TTL.
+known_recipes = BoundedCache(SHORT_URL_CACHE_SIZE, SHORT_URL_KNOWN_TTL)
+unknown_codes = BoundedCache(SHORT_URL_CACHE_SIZE, SHORT_URL_NEGATIVE_TTL)
+
+
+def resolve_cached(short_url):
+    """
+    Разрешает код только по кешам процесса, без базы данных.
+    Возвращает (True, id или None), если ответ известен,
+    иначе (False, None).
+    """
+    if short_url in unknown_codes:
+        return True, None
+    recipe_id = decode(short_url)
+    if recipe_id is None:
+        unknown_codes.add(short_url)
+        return True, None
+    if recipe_id in known_recipes:
+        return True, recipe_id
+    return False, None
+
+
+def resolve(short_url):
+    """
+    Находит id рецепта по короткому коду. База данных запрашивается
+    только для кодов, которых еще нет ни в одном из кешей.
+    """
+    found, recipe_id = resolve_cached(short_url)
+    if found:
+        return recipe_id
+    recipe_id = decode(short_url)
+    if not Recipe.objects.filter(pk=recipe_id).exists():
+        unknown_codes.add(short_url)
+        return None
+    known_recipes.add(recipe_id)
+    return recipe_id
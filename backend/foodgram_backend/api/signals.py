@@ -0,0 +1,270 @@
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+
+from rest_framework.authtoken.models import Token
+
+from users.models import MyUser, Subscription
+from .authentication import (
+    invalidate_token,
+    invalidate_user_tokens,
+    revoke_refresh_tokens,
+)
+from .counters import change_counter
+from .feeds import add_author_to_feed, fan_out_recipe, remove_author_from_feed
+from .images import schedule_recipe_image
+from .models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    Tag,
+)
+from .pagination import invalidate_counts
+from .shortlinks import encode, known_recipes
+from .similarity import update_signatures
+from .tags import tag_slugs
+
+# Таблицы, от которых зависят закешированные количества страниц:
+# сами списки и фильтры по избранному и списку покупок.
+COUNTED_MODELS = (Recipe, Favorite, ShoppingCart, Subscription, MyUser)
+
+
+def invalidate_counts_on_create(sender, created, **kwargs):
+    if created:
+        invalidate_counts(sender)
+
+
+def invalidate_counts_on_delete(sender, **kwargs):
+    invalidate_counts(sender)
+
+
+# Подписываемся на конкретные модели: обработчик без sender
+# отключил бы быстрое удаление (fast delete) для всех моделей.
+for model in COUNTED_MODELS:
+    post_save.connect(invalidate_counts_on_create, sender=model)
+    post_delete.connect(invalidate_counts_on_delete, sender=model)
+
+
+# Денормализованные счетчики: модель связи -> (модель со счетчиком,
+# поле связи, поле счетчика). Сигналы покрывают API, админку и каскадное
+# удаление; пакетные add_links/remove_links обходят сигналы и меняют
+# счетчики сами.
+COUNTERS = {
+    Favorite: (Recipe, 'recipe_id', 'favorites_count'),
+    ShoppingCart: (Recipe, 'recipe_id', 'carts_count'),
+    Subscription: (MyUser, 'subscribed_to_id', 'subscribers_count'),
+    Recipe: (MyUser, 'author_id', 'recipes_count'),
+}
+
+
+def increment_counter(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        model, link, field = COUNTERS[sender]
+        change_counter(model, getattr(instance, link), field, 1)
+
+
+def decrement_counter(sender, instance, **kwargs):
+    model, link, field = COUNTERS[sender]
+    change_counter(model, getattr(instance, link), field, -1)
+
+
+for model in COUNTERS:
+    post_save.connect(increment_counter, sender=model)
+    post_delete.connect(decrement_counter, sender=model)
+
+
+def process_image_on_save(sender, instance, **kwargs):
+    """
+    Отправляет новое изображение рецепта на нарезку вариантов.
+    """
+    source = (instance.image_variants or {}).get('source')
+    if instance.image and instance.image.name != source:
+        schedule_recipe_image(instance.pk)
+
+
+post_save.connect(process_image_on_save, sender=Recipe)
+
+
+def assign_short_url(sender, instance, created, **kwargs):
+    """
+    Назначает короткий код новому рецепту, чтобы ссылка
+    не требовала записи при первом запросе.
+    """
+    if created and not instance.short_url:
+        instance.short_url = encode(instance.pk)
+        Recipe.objects.filter(pk=instance.pk).update(
+            short_url=instance.short_url
+        )
+
+
+def forget_short_url(sender, instance, **kwargs):
+    known_recipes.discard(instance.pk)
+
+
+post_save.connect(assign_short_url, sender=Recipe)
+post_delete.connect(forget_short_url, sender=Recipe)
+
+
+# Поля автора, входящие в закешированное представление рецепта.
+AUTHOR_FRAGMENT_FIELDS = {
+    'email', 'username', 'first_name', 'last_name', 'avatar',
+}
+
+
+def expire_recipe(sender, instance, created, **kwargs):
+    """
+    Меняет версию рецепта после изменения. Ингредиенты и теги
+    из сериализатора и админки сохраняются вместе с рецептом
+    в одной транзакции, поэтому отдельная версия им не нужна.
+    """
+    if not created:
+        Recipe.objects.filter(pk=instance.pk).bump_version()
+
+
+def expire_recipe_of_ingredient(sender, instance, **kwargs):
+    Recipe.objects.filter(pk=instance.recipe_id).bump_version()
+
+
+def expire_recipes_of_tags(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        Recipe.objects.filter(pk=instance.pk).bump_version()
+    elif pk_set:
+        Recipe.objects.filter(pk__in=pk_set).bump_version()
+
+
+def expire_recipes_of_tag(sender, instance, **kwargs):
+    Recipe.objects.filter(tags=instance).bump_version()
+
+
+def expire_recipes_of_catalog_ingredient(sender, instance, **kwargs):
+    Recipe.objects.filter(ingredients=instance).bump_version()
+
+
+def expire_recipes_of_author(sender, instance, created, update_fields,
+                             **kwargs):
+    """
+    Сбрасывает рецепты автора при изменении его профиля.
+    Обновление last_login при входе рецепты не затрагивает.
+    """
+    if created:
+        return
+    if update_fields and not AUTHOR_FRAGMENT_FIELDS & set(update_fields):
+        return
+    Recipe.objects.filter(author=instance).bump_version()
+
+
+post_save.connect(expire_recipe, sender=Recipe)
+post_save.connect(expire_recipe_of_ingredient, sender=RecipeIngredient)
+m2m_changed.connect(expire_recipes_of_tags, sender=Recipe.tags.through)
+post_save.connect(expire_recipes_of_tag, sender=Tag)
+# Связи с тегом удаляются вместе с ним, поэтому рецепты ищем до удаления.
+pre_delete.connect(expire_recipes_of_tag, sender=Tag)
+post_save.connect(expire_recipes_of_catalog_ingredient, sender=Ingredient)
+pre_delete.connect(expire_recipes_of_catalog_ingredient, sender=Ingredient)
+post_save.connect(expire_recipes_of_author, sender=MyUser)
+
+
+def refresh_search_fields(sender, instance, **kwargs):
+    """
+    Пересчитывает поисковый вектор, массив ингредиентов и подпись
+    MinHash после фиксации транзакции, когда ингредиенты рецепта
+    уже сохранены.
+    """
+    if sender is Ingredient:
+        transaction.on_commit(
+            Recipe.objects.filter(ingredients=instance).update_search_vector
+        )
+        return
+    recipe_id = instance.pk if sender is Recipe else instance.recipe_id
+    recipes = Recipe.objects.filter(pk=recipe_id)
+    transaction.on_commit(recipes.update_search_vector)
+    transaction.on_commit(recipes.update_ingredient_ids)
+    transaction.on_commit(lambda: update_signatures([recipe_id]))
+
+
+def refresh_search_fields_on_ingredient_delete(sender, instance, **kwargs):
+    """
+    Ингредиент удаляется из рецептов каскадом, без сигналов,
+    поэтому рецепты запоминаются до удаления.
+    """
+    recipe_ids = list(
+        instance.ingredient_recipes.values_list('recipe_id', flat=True)
+    )
+    recipes = Recipe.objects.filter(pk__in=recipe_ids)
+    transaction.on_commit(recipes.update_search_vector)
+    transaction.on_commit(recipes.update_ingredient_ids)
+    transaction.on_commit(lambda: update_signatures(recipe_ids))
+
+
+post_save.connect(refresh_search_fields, sender=Recipe)
+post_save.connect(refresh_search_fields, sender=RecipeIngredient)
+post_save.connect(refresh_search_fields, sender=Ingredient)
+pre_delete.connect(
+    refresh_search_fields_on_ingredient_delete, sender=Ingredient
+)
+
+
+def forget_tag_slugs(sender, **kwargs):
+    tag_slugs.clear()
+
+
+post_save.connect(forget_tag_slugs, sender=Tag)
+post_delete.connect(forget_tag_slugs, sender=Tag)
+
+
+def fan_out_on_create(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: fan_out_recipe(instance.pk))
+
+
+def add_to_feed_on_subscribe(sender, instance, created, **kwargs):
+    if created:
+        add_author_to_feed(instance.subscriber_id, instance.subscribed_to_id)
+
+
+def remove_from_feed_on_unsubscribe(sender, instance, **kwargs):
+    remove_author_from_feed(instance.subscriber_id, instance.subscribed_to_id)
+
+
+post_save.connect(fan_out_on_create, sender=Recipe)
+post_save.connect(add_to_feed_on_subscribe, sender=Subscription)
+post_delete.connect(remove_from_feed_on_unsubscribe, sender=Subscription)
+
+
+def forget_token(sender, instance, **kwargs):
+    """
+    Выход (удаление токена) сбрасывает его кеш сразу после фиксации.
+    """
+    key = instance.key
+    transaction.on_commit(lambda: invalidate_token(key))
+
+
+def forget_user_tokens(sender, instance, **kwargs):
+    """
+    В кеше токенов лежит сам пользователь, поэтому любое его сохранение
+    (смена пароля, деактивация, новый аватар) сбрасывает кеш.
+    """
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_user_tokens(user_id))
+
+
+post_delete.connect(forget_token, sender=Token)
+post_save.connect(forget_user_tokens, sender=MyUser)
+
+
+def revoke_tokens_on_deactivate(sender, instance, created, **kwargs):
+    if not created and not instance.is_active:
+        user_id = instance.pk
+        transaction.on_commit(lambda: revoke_refresh_tokens(user_id))
+
+
+post_save.connect(revoke_tokens_on_deactivate, sender=MyUser)
@@ -0,0 +1,213 @@
+import numpy as np
+from django.db import connection, transaction
+
+from .constants import (
+    DUPLICATE_BANDS,
+    DUPLICATE_THRESHOLD,
+    LSH_BANDS,
+    MINHASH_PERMUTATIONS,
+    MINHASH_SEED,
+    RECOMMENDATIONS_TOP_K,
+    SIMILARITY_MAX_CANDIDATES,
+    SIMILARITY_THRESHOLD,
+)
+from .models import RecipeBand, RecipeIngredient, RecipeSignature
+
+# Хеш-функции MinHash вида (a * x + b) mod p. Коэффициенты
+# фиксированы, чтобы подписи не менялись между процессами.
+PRIME = (1 << 31) - 1
+COEFFICIENTS = np.random.default_rng(MINHASH_SEED).integers(
+    1, PRIME, size=(2, MINHASH_PERMUTATIONS), dtype=np.int64
+)
+# Нечетный множитель полиномиального хеша полосы по модулю 2**64:
+# степень двойки сдвигала бы первые значения полосы за разрядную сетку.
+BUCKET_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# Пары рецептов с общей длинной полосой. Сначала отбираются
+# корзины, где больше одного рецепта, - таких единицы.
+DUPLICATES_SQL = '''
+    WITH shared AS MATERIALIZED (
+        SELECT band, bucket FROM {table}
+        WHERE band >= %s
+        GROUP BY band, bucket
+        HAVING count(*) > 1
+    )
+    SELECT DISTINCT a.recipe_id, b.recipe_id
+    FROM shared
+    JOIN {table} a ON a.band = shared.band AND a.bucket = shared.bucket
+    JOIN {table} b ON b.band = shared.band AND b.bucket = shared.bucket
+    WHERE a.recipe_id < b.recipe_id
+'''
+
+# Кандидаты в похожие: рецепты из тех же корзин коротких полос,
+# больше совпавших полос - выше. Читается только индекс корзин.
+CANDIDATES_SQL = '''
+    SELECT other.recipe_id
+    FROM {table} own
+    JOIN {table} other
+        ON other.band = own.band AND other.bucket = own.bucket
+    WHERE own.recipe_id = %s
+        AND own.band < %s
+        AND other.recipe_id <> own.recipe_id
+    GROUP BY other.recipe_id
+    ORDER BY count(*) DESC, other.recipe_id
+    LIMIT %s
+'''
+
+INSERT_BANDS_SQL = '''
+    INSERT INTO {table} (recipe_id, band, bucket)
+    SELECT * FROM unnest(%s::bigint[], %s::smallint[], %s::bigint[])
+'''
+
+
+def minhash_signatures(pairs):
+    """
+    Считает подписи по парам (recipe_id, ingredient_id).
+    Возвращает отсортированные id рецептов и матрицу подписей
+    рецепт x MINHASH_PERMUTATIONS.
+    """
+    if not len(pairs):
+        return (
+            np.empty(0, dtype=np.int64),
+            np.empty((0, MINHASH_PERMUTATIONS), dtype=np.uint32),
+        )
+    pairs = pairs[np.argsort(pairs[:, 0], kind='stable')]
+    recipe_ids, starts = np.unique(pairs[:, 0], return_index=True)
+    elements = pairs[:, 1:] % PRIME
+    hashes = (COEFFICIENTS[0] * elements + COEFFICIENTS[1]) % PRIME
+    signatures = np.minimum.reduceat(hashes, starts, axis=0)
+    return recipe_ids, signatures.astype(np.uint32)
+
+
+def band_buckets(signatures, bands):
+    """
+    Делит подписи на bands полос и сворачивает каждую
+    полосу в одно число int64.
+    """
+    rows = signatures.reshape(
+        len(signatures), bands, MINHASH_PERMUTATIONS // bands
+    ).astype(np.uint64)
+    buckets = np.zeros(rows.shape[:2], dtype=np.uint64)
+    for column in range(rows.shape[2]):
+        buckets = buckets * BUCKET_MULTIPLIER + rows[:, :, column]
+    return buckets.view(np.int64)
+
+
+@transaction.atomic
+def update_signatures(recipe_ids):
+    """
+    Пересчитывает подписи и корзины LSH рецептов по их ингредиентам.
+    Полосы 0..LSH_BANDS-1 короткие и ищут похожие рецепты, следующие
+    DUPLICATE_BANDS длинные и совпадают только у почти одинаковых.
+    """
+    recipe_ids = list(recipe_ids)
+    pairs = np.array(
+        RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    ids, signatures = minhash_signatures(pairs)
+    buckets = np.hstack([
+        band_buckets(signatures, LSH_BANDS),
+        band_buckets(signatures, DUPLICATE_BANDS),
+    ])
+    RecipeSignature.objects.filter(recipe_id__in=recipe_ids).delete()
+    RecipeBand.objects.filter(recipe_id__in=recipe_ids).delete()
+    RecipeSignature.objects.bulk_create(
+        RecipeSignature(recipe_id=recipe_id, signature=signature.tobytes())
+        for recipe_id, signature in zip(ids.tolist(), signatures)
+    )
+    recipes = np.repeat(ids, buckets.shape[1])
+    bands = np.tile(np.arange(buckets.shape[1]), len(ids))
+    buckets = buckets.ravel()
+    if connection.vendor != 'postgresql':
+        RecipeBand.objects.bulk_create(
+            RecipeBand(recipe_id=recipe_id, band=band, bucket=bucket)
+            for recipe_id, band, bucket in zip(
+                recipes.tolist(), bands.tolist(), buckets.tolist()
+            )
+        )
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            INSERT_BANDS_SQL.format(table=RecipeBand._meta.db_table),
+            [recipes.tolist(), bands.tolist(), buckets.tolist()],
+        )
+
+
+def load_signatures(recipe_ids):
+    """
+    Читает подписи рецептов. Возвращает id по возрастанию
+    и матрицу подписей.
+    """
+    rows = RecipeSignature.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by('recipe_id').values_list('recipe_id', 'signature')
+    ids = []
+    signatures = []
+    for recipe_id, signature in rows:
+        ids.append(recipe_id)
+        signatures.append(np.frombuffer(signature, dtype=np.uint32))
+    if not ids:
+        return (
+            np.empty(0, dtype=np.int64),
+            np.empty((0, MINHASH_PERMUTATIONS), dtype=np.uint32),
+        )
+    return np.array(ids, dtype=np.int64), np.vstack(signatures)
+
+
+def find_similar(recipe_id, threshold=SIMILARITY_THRESHOLD,
+                 limit=RECOMMENDATIONS_TOP_K):
+    """
+    Рецепты с похожим набором ингредиентов: [(id, оценка), ...]
+    по убыванию оценки Жаккара. Кандидаты берутся из совпавших
+    корзин LSH, поэтому весь каталог не перебирается.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            CANDIDATES_SQL.format(table=RecipeBand._meta.db_table),
+            [recipe_id, LSH_BANDS, SIMILARITY_MAX_CANDIDATES],
+        )
+        candidates = [row[0] for row in cursor.fetchall()]
+    if not candidates:
+        return []
+    ids, signatures = load_signatures([recipe_id, *candidates])
+    own = signatures[ids == recipe_id]
+    if not len(own):
+        return []
+    scores = (signatures == own[0]).mean(axis=1)
+    keep = (ids != recipe_id) & (scores >= threshold)
+    ids, scores = ids[keep], scores[keep]
+    order = np.lexsort((ids, -scores))[:limit]
+    return list(zip(ids[order].tolist(), scores[order].tolist()))
+
+
+def find_duplicates(threshold=DUPLICATE_THRESHOLD):
+    """
+    Пары рецептов с почти одинаковыми ингредиентами:
+    [(id, id, оценка), ...] по убыванию оценки. Кандидаты - пары
+    с общей длинной полосой, оценка проверяется по подписям.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            DUPLICATES_SQL.format(table=RecipeBand._meta.db_table),
+            [LSH_BANDS],
+        )
+        pairs = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+    if not len(pairs):
+        return []
+    ids, signatures = load_signatures(np.unique(pairs).tolist())
+    # Подписи приходят по возрастанию id, позиции ищем бинарно.
+    first = np.searchsorted(ids, pairs[:, 0])
+    second = np.searchsorted(ids, pairs[:, 1])
+    scores = (signatures[first] == signatures[second]).mean(axis=1)
+    keep = scores >= threshold
+    pairs, scores = pairs[keep], scores[keep]
+    order = np.argsort(-scores, kind='stable')
+    return [
+        (first, second, score)
+        for (first, second), score in zip(
+            pairs[order].tolist(), scores[order].tolist()
+        )
+    ]
@@ -0,0 +1,52 @@
+import time
+from threading import Lock
+
+from .constants import TAG_CACHE_TTL
+from .models import Tag
+
+
+class TagSlugCache:
+    """
+    Соответствие slug -> id всех тегов в памяти процесса.
+    Тегов немного и меняются они редко: в своем процессе кеш
+    сбрасывается сигналами, в остальных устаревает через TTL,
+    а незнакомый slug перечитывает его из базы (см. is_known_slug).
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.slugs = None
+        self.expires = 0
+        self.lock = Lock()
+
+    def get_all(self, refresh=False):
+        with self.lock:
+            if not refresh and self.slugs is not None and (
+                self.expires > time.monotonic()
+            ):
+                return self.slugs
+        slugs = dict(Tag.objects.values_list('slug', 'id'))
+        with self.lock:
+            self.slugs = slugs
+            self.expires = time.monotonic() + self.ttl
+        return slugs
+
+    def clear(self):
+        with self.lock:
+            self.slugs = None
+
+
+tag_slugs = TagSlugCache(TAG_CACHE_TTL)
+
+
+def get_tag_choices():
+    return [(slug, slug) for slug in tag_slugs.get_all()]
+
+
+def is_known_slug(slug):
+    """
+    Тег мог быть создан в другом процессе, кеш которого уже сброшен:
+    незнакомый slug перед ошибкой проверяется по базе.
+    """
+    return slug in tag_slugs.get_all() or (
+        slug in tag_slugs.get_all(refresh=True)
+    )
@@ -0,0 +1,823 @@
+import base64
+import io
+import pickle
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, router, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from foodgram_backend import db_routing
+from users.models import MyUser, Subscription
+from . import shortlinks
+from .authentication import (
+    CachedTokenAuthentication,
+    get_token_cache_key,
+    local_tokens,
+)
+from .constants import SHORT_URL_KNOWN_TTL
+from .counters import rebuild_recipe_counters, rebuild_user_counters
+from .exports import normalize_units
+from .management.commands.import_recipes import Command as ImportCommand
+from .models import (
+    Favorite,
+    FeedItem,
+    Ingredient,
+    Recipe,
+    ShoppingCart,
+    SimilarRecipe,
+    Tag,
+)
+from .tags import tag_slugs
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (10, 10), 'white').save(buffer, 'PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_WORKERS=0)
+class RecipeTestCase(TestCase):
+    """
+    Автор, читатель, теги и ингредиенты для тестов рецептов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = MyUser.objects.create_user(
+            email='author@example.com', username='author', password='x',
+            first_name='a', last_name='a',
+        )
+        cls.reader = MyUser.objects.create_user(
+            email='reader@example.com', username='reader', password='x',
+            first_name='r', last_name='r',
+        )
+        cls.tags = [
+            Tag.objects.create(name=f'tag{i}', slug=f'tag{i}')
+            for i in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ingredient{i}', measurement_unit='г'
+            )
+            for i in range(6)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Кеши представлений, количеств и тегов живут дольше теста.
+        cache.clear()
+        tag_slugs.clear()
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+        self.reader_client = APIClient()
+        self.reader_client.force_authenticate(self.reader)
+
+    def recipe_data(self, ingredients, name='recipe'):
+        return {
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 10}
+                for ingredient in ingredients
+            ],
+            'tags': [tag.id for tag in self.tags],
+            'image': make_image(),
+            'name': name,
+            'text': 'text',
+            'cooking_time': 5,
+        }
+
+    def create_recipes(self, author, count):
+        client = APIClient()
+        client.force_authenticate(author)
+        for number in range(count):
+            response = client.post(
+                '/api/recipes/',
+                self.recipe_data(self.ingredients, f'recipe{number}'),
+                format='json',
+            )
+            self.assertEqual(response.status_code, 201, response.content)
+        cache.clear()
+
+
+class QueryCountTests(RecipeTestCase):
+    """
+    Число запросов к базе на основных эндпоинтах не должно
+    зависеть от размера страницы, числа ингредиентов и тегов.
+    """
+
+    def count_queries(self):
+        """
+        Запросы подсчета списка: оценку планировщика EstimatedCount
+        спрашивает только у Postgres, затем следует точный COUNT.
+        """
+        return 2 if connection.vendor == 'postgresql' else 1
+
+    def test_recipe_list(self):
+        self.create_recipes(self.author, 5)
+        recipes = Recipe.objects.all()
+        Favorite.objects.create(user=self.reader, recipe=recipes[0])
+        ShoppingCart.objects.create(user=self.reader, recipe=recipes[1])
+        Subscription.objects.create(
+            subscriber=self.reader, subscribed_to=self.author
+        )
+        with self.assertNumQueries(3 + self.count_queries()):
+            response = self.reader_client.get('/api/recipes/')
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_recipe_retrieve(self):
+        self.create_recipes(self.author, 1)
+        recipe = Recipe.objects.get()
+        with self.assertNumQueries(3):
+            response = self.reader_client.get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(len(response.json()['ingredients']), 6)
+
+    def test_recipe_create(self):
+        with self.assertNumQueries(14):
+            response = self.author_client.post(
+                '/api/recipes/',
+                self.recipe_data(self.ingredients),
+                format='json',
+            )
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_recipe_update(self):
+        self.create_recipes(self.author, 1)
+        recipe = Recipe.objects.get()
+        with self.assertNumQueries(12):
+            response = self.author_client.patch(
+                f'/api/recipes/{recipe.id}/',
+                self.recipe_data(self.ingredients[2:], 'updated'),
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_subscriptions_list(self):
+        for number in range(3):
+            author = MyUser.objects.create_user(
+                email=f'author{number}@example.com',
+                username=f'author{number}', password='x',
+                first_name='a', last_name='a',
+            )
+            self.create_recipes(author, 2)
+            Subscription.objects.create(
+                subscriber=self.reader, subscribed_to=author
+            )
+        with self.assertNumQueries(3):
+            response = self.reader_client.get(
+                '/api/users/subscriptions/?recipes_limit=1'
+            )
+        results = response.json()['results']
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(len(item['recipes']) == 1 for item in results))
+
+
+class CountCacheTests(RecipeTestCase):
+    """
+    Количество для списка рецептов кешируется по набору фильтров,
+    общему для всех пользователей, и сбрасывается только записью
+    в таблицы, которые читает запрос подсчета.
+    """
+
+    def get_count(self, client, url='/api/recipes/'):
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response['X-Count-Strategy'], response.json()['count']
+
+    def test_count_is_shared_between_users(self):
+        self.create_recipes(self.author, 2)
+        self.assertEqual(self.get_count(self.reader_client), ('exact', 2))
+        self.assertEqual(self.get_count(self.author_client), ('cached', 2))
+
+    def test_favorite_keeps_plain_count(self):
+        self.create_recipes(self.author, 2)
+        recipe = Recipe.objects.first()
+        url = '/api/recipes/?is_favorited=1'
+        self.assertEqual(self.get_count(self.reader_client), ('exact', 2))
+        self.assertEqual(self.get_count(self.reader_client, url), ('exact', 0))
+        self.reader_client.post(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertEqual(self.get_count(self.reader_client), ('cached', 2))
+        self.assertEqual(self.get_count(self.reader_client, url), ('exact', 1))
+
+    def test_new_recipe_resets_count(self):
+        self.create_recipes(self.author, 1)
+        self.assertEqual(self.get_count(self.reader_client), ('exact', 1))
+        response = self.author_client.post(
+            '/api/recipes/', self.recipe_data(self.ingredients),
+            format='json',
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.get_count(self.reader_client), ('exact', 2))
+
+
+class CounterTests(RecipeTestCase):
+    """
+    Счетчики сходятся с фактическими данными и после удаления
+    в обход API: из админки или каскадом.
+    """
+
+    def assertCounters(self, recipe, favorites, carts, recipes, subscribers):
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.carts_count),
+            (favorites, carts),
+        )
+        self.assertEqual(
+            (self.author.recipes_count, self.author.subscribers_count),
+            (recipes, subscribers),
+        )
+        self.assertEqual(rebuild_recipe_counters(), 0)
+        self.assertEqual(rebuild_user_counters(), 0)
+
+    def test_api_and_cascade(self):
+        self.create_recipes(self.author, 2)
+        recipe = Recipe.objects.first()
+        for action in ('favorite', 'shopping_cart'):
+            response = self.reader_client.post(
+                f'/api/recipes/{recipe.id}/{action}/'
+            )
+            self.assertEqual(response.status_code, 201, response.content)
+        response = self.reader_client.post(
+            f'/api/users/{self.author.id}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertCounters(recipe, 1, 1, 2, 1)
+
+        Favorite.objects.get(recipe=recipe).delete()
+        self.assertCounters(recipe, 0, 1, 2, 1)
+        # Удаление читателя каскадом удаляет его список и подписку.
+        self.reader.delete()
+        self.assertCounters(recipe, 0, 0, 2, 0)
+        Recipe.objects.exclude(pk=recipe.pk).delete()
+        self.assertCounters(recipe, 0, 0, 1, 0)
+
+
+class CursorPaginationTests(RecipeTestCase):
+    """
+    Курсор листает рецепты от новых к старым в обе стороны
+    и не смешивается с другой сортировкой.
+    """
+
+    def get_page(self, url):
+        response = self.reader_client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertIsNone(data['count'])
+        names = [recipe['name'] for recipe in data['results']]
+        return names, data['next'], data['previous']
+
+    def test_next_and_previous(self):
+        self.create_recipes(self.author, 5)
+        names, next_url, previous_url = self.get_page(
+            '/api/recipes/?cursor=&limit=2'
+        )
+        self.assertEqual(names, ['recipe4', 'recipe3'])
+        self.assertIsNone(previous_url)
+        names, next_url, previous_url = self.get_page(next_url)
+        self.assertEqual(names, ['recipe2', 'recipe1'])
+        names, next_url, last_previous_url = self.get_page(next_url)
+        self.assertEqual(names, ['recipe0'])
+        self.assertIsNone(next_url)
+        names, next_url, _ = self.get_page(last_previous_url)
+        self.assertEqual(names, ['recipe2', 'recipe1'])
+        self.assertIsNotNone(next_url)
+        names, next_url, previous_url = self.get_page(previous_url)
+        self.assertEqual(names, ['recipe4', 'recipe3'])
+        self.assertIsNone(previous_url)
+        self.assertIsNotNone(next_url)
+
+    def test_other_ordering(self):
+        response = self.reader_client.get(
+            '/api/recipes/?cursor=&ordering=popular'
+        )
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertIn('cursor', response.json())
+
+    def test_invalid_cursor(self):
+        response = self.reader_client.get('/api/recipes/?cursor=broken')
+        self.assertEqual(response.status_code, 404, response.content)
+
+
+class IngredientFilterTests(RecipeTestCase):
+    """
+    Поиск по имеющимся ингредиентам: рецепты, которым не хватает
+    не больше max_missing ингредиентов, от полностью готовых.
+    """
+
+    def test_have_ingredients(self):
+        first, second, third, fourth = self.ingredients[:4]
+        # Массив ингредиентов рецепта заполняется после фиксации.
+        with self.captureOnCommitCallbacks(execute=True):
+            for name, ingredients in (
+                ('ready', [first, second]),
+                ('one_missing', [first, second, third]),
+                ('unrelated', [fourth]),
+            ):
+                response = self.author_client.post(
+                    '/api/recipes/', self.recipe_data(ingredients, name),
+                    format='json',
+                )
+                self.assertEqual(
+                    response.status_code, 201, response.content
+                )
+        url = f'/api/recipes/?have_ingredients={first.id},{second.id}'
+        for query, expected in (
+            ('', [('ready', 0)]),
+            ('&max_missing=1', [('ready', 0), ('one_missing', 1)]),
+        ):
+            response = self.reader_client.get(url + query)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(
+                [
+                    (recipe['name'], recipe['ingredients_missing'])
+                    for recipe in response.json()['results']
+                ],
+                expected,
+            )
+
+
+class ShoppingListTests(RecipeTestCase):
+    """
+    Суммы списка покупок переводятся в общую единицу и выводятся
+    в удобной: 500 г и 1 кг муки дают 1.5 кг.
+    """
+
+    def test_normalize_units(self):
+        rows = [
+            ('вода', 'л', 1.5),
+            ('молоко', 'мл', 500),
+            ('молоко', 'стакан', 1),
+            ('мука', 'г', 500),
+            ('мука', 'кг', 1),
+            ('перец', 'по вкусу', 1),
+            ('сахар', 'ст. л.', 2),
+            ('соль', 'мг', 300),
+            ('яйца', 'шт', 2),
+            ('яйца', 'шт.', 1),
+        ]
+        result = normalize_units(
+            {
+                'ingredient__name': name,
+                'ingredient__measurement_unit': unit,
+                'total': total,
+            }
+            for name, unit, total in rows
+        )
+        self.assertEqual(
+            [(row['name'], row['total'], row['unit']) for row in result],
+            [
+                ('вода', '1.5', 'л'),
+                ('молоко', '750', 'мл'),
+                ('мука', '1.5', 'кг'),
+                ('перец', '', 'по вкусу'),
+                ('сахар', '2', 'ст. л.'),
+                ('соль', '300', 'мг'),
+                ('яйца', '3', 'шт.'),
+            ],
+        )
+        self.assertEqual(normalize_units([]), [])
+
+    def test_download(self):
+        for unit in ('г', 'кг'):
+            ingredient = Ingredient.objects.create(
+                name='мука', measurement_unit=unit
+            )
+            response = self.author_client.post(
+                '/api/recipes/', self.recipe_data([ingredient], unit),
+                format='json',
+            )
+            self.assertEqual(response.status_code, 201, response.content)
+            self.reader_client.post(
+                f'/api/recipes/{response.json()["id"]}/shopping_cart/'
+            )
+        response = self.reader_client.get(
+            '/api/recipes/download_shopping_cart/?format=txt'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            'мука - 10.01 кг\n',
+        )
+
+
+class BulkTests(RecipeTestCase):
+    """
+    Пакетные операции идемпотентны: повтор не создает дублей
+    и не меняет счетчики повторно.
+    """
+
+    def test_favorite_many(self):
+        self.create_recipes(self.author, 3)
+        first, second, third = Recipe.objects.order_by('id')
+        url = '/api/recipes/favorite/'
+        for ids in ([first.id, second.id], [first.id, second.id, third.id]):
+            response = self.reader_client.post(
+                url, {'ids': ids + ids}, format='json'
+            )
+            self.assertEqual(response.status_code, 201, response.content)
+            self.assertEqual([item['id'] for item in response.json()], ids)
+        self.assertEqual(Favorite.objects.filter(user=self.reader).count(), 3)
+        for _ in range(2):
+            response = self.reader_client.delete(
+                url, {'ids': [first.id, third.id]}, format='json'
+            )
+            self.assertEqual(response.status_code, 204, response.content)
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', flat=True
+            )),
+            [0, 1, 0],
+        )
+        self.assertEqual(rebuild_recipe_counters(), 0)
+
+    def test_missing_recipe(self):
+        self.create_recipes(self.author, 1)
+        recipe = Recipe.objects.get()
+        response = self.reader_client.post(
+            '/api/recipes/shopping_cart/',
+            {'ids': [recipe.id, recipe.id + 1]}, format='json',
+        )
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertFalse(ShoppingCart.objects.exists())
+
+    def test_subscribe_many(self):
+        url = '/api/users/subscribe/'
+        response = self.reader_client.post(
+            url, {'ids': [self.reader.id]}, format='json'
+        )
+        self.assertEqual(response.status_code, 400, response.content)
+        for _ in range(2):
+            response = self.reader_client.post(
+                url, {'ids': [self.author.id]}, format='json'
+            )
+            self.assertEqual(response.status_code, 201, response.content)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 1)
+        for _ in range(2):
+            response = self.reader_client.delete(
+                url, {'ids': [self.author.id]}, format='json'
+            )
+            self.assertEqual(response.status_code, 204, response.content)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, 0)
+        self.assertFalse(Subscription.objects.exists())
+
+
+class ImportTests(RecipeTestCase):
+    """
+    Загрузка, прерванная сразу после фиксации пачки, продолжается
+    со следующей пачки и не дублирует рецепты.
+    """
+
+    def test_resume_after_crash(self):
+        self.create_recipes(self.author, 3)
+        path = f'{MEDIA_ROOT}/recipes.ndjson'
+        call_command('export_recipes', output=path, stdout=io.StringIO())
+        Recipe.objects.all().delete()
+        import_batch = ImportCommand.import_batch
+
+        def crash_after_first(command, *args):
+            import_batch(command, *args)
+            raise KeyboardInterrupt
+
+        with mock.patch.object(
+            ImportCommand, 'import_batch', crash_after_first
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command(
+                    'import_recipes', path, batch_size=2,
+                    stdout=io.StringIO(),
+                )
+        self.assertEqual(Recipe.objects.count(), 2)
+        call_command(
+            'import_recipes', path, batch_size=2,
+            stdout=io.StringIO(), stderr=io.StringIO(),
+        )
+        self.assertEqual(
+            sorted(Recipe.objects.values_list('name', flat=True)),
+            ['recipe0', 'recipe1', 'recipe2'],
+        )
+
+
+class TagFilterTests(RecipeTestCase):
+    """
+    Тег, созданный в другом процессе, сразу доступен в фильтре,
+    хотя кеш тегов этого процесса еще не сброшен.
+    """
+
+    def test_tag_from_other_process(self):
+        self.create_recipes(self.author, 1)
+        response = self.reader_client.get('/api/recipes/?tags=tag0')
+        self.assertEqual(response.json()['count'], 1)
+        # bulk_create не вызывает сигналы, как и запись в другом процессе.
+        Tag.objects.bulk_create([Tag(name='new', slug='new')])
+        response = self.reader_client.get('/api/recipes/?tags=new')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_unknown_tag(self):
+        response = self.reader_client.get('/api/recipes/?tags=missing')
+        self.assertEqual(response.status_code, 400, response.content)
+
+
+class ShortLinkTests(RecipeTestCase):
+    """
+    Код удаленного рецепта перестает работать и в процессах,
+    которые не получили сигнал об удалении.
+    """
+
+    def test_deleted_recipe_expires(self):
+        self.create_recipes(self.author, 1)
+        recipe = Recipe.objects.get()
+        url = f'/s/{recipe.short_url}/'
+        self.assertEqual(self.client.get(url).status_code, 302)
+        recipe_id = recipe.id
+        recipe.delete()
+        # Так код остается в кеше другого процесса.
+        shortlinks.known_recipes.add(recipe_id)
+        self.assertEqual(self.client.get(url).status_code, 302)
+        later = time.monotonic() + SHORT_URL_KNOWN_TTL + 1
+        with mock.patch.object(
+            shortlinks.time, 'monotonic', return_value=later
+        ):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class RecommendationTests(RecipeTestCase):
+    """
+    Инкрементальный расчет похожих рецептов дает то же,
+    что полный, в том числе для рецептов без новых добавлений.
+    """
+
+    def build(self, *args):
+        call_command(
+            'build_recommendations', *args,
+            stdout=io.StringIO(), stderr=io.StringIO(),
+        )
+        return {
+            (item.recipe_id, item.similar_id, round(item.score, 5))
+            for item in SimilarRecipe.objects.all()
+        }
+
+    def test_incremental_matches_full(self):
+        self.create_recipes(self.author, 4)
+        first, second, third, fourth = Recipe.objects.order_by('id')
+        for recipe in (first, second):
+            Favorite.objects.create(user=self.author, recipe=recipe)
+        for recipe in (second, third):
+            Favorite.objects.create(user=self.reader, recipe=recipe)
+        self.build()
+        # Первый и второй рецепты не меняются, но получают соседа.
+        Favorite.objects.create(user=self.author, recipe=fourth)
+        incremental = self.build('--incremental')
+        self.assertIn(
+            fourth.id,
+            SimilarRecipe.objects.filter(recipe=first).values_list(
+                'similar_id', flat=True
+            ),
+        )
+        self.assertEqual(incremental, self.build())
+
+
+class FeedTests(RecipeTestCase):
+    """
+    Ленты обрезаются при каждой записи, а автор возвращается
+    к раскладке по лентам, когда подписчиков становится меньше.
+    """
+
+    def setUp(self):
+        super().setUp()
+        response = self.reader_client.post(
+            f'/api/users/{self.author.id}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def publish(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_recipes(self.author, count)
+
+    def feed(self):
+        return list(FeedItem.objects.filter(user=self.reader).order_by(
+            '-created_at', '-recipe_id'
+        ).values_list('recipe_id', flat=True))
+
+    def test_feed_is_trimmed_on_publish(self):
+        with mock.patch('api.feeds.FEED_MAX_LENGTH', 2), mock.patch(
+            'api.feeds.FEED_TRIM_EVERY', 1
+        ):
+            self.publish(3)
+        newest = Recipe.objects.order_by('-created_at', '-id')[:2]
+        self.assertEqual(self.feed(), [recipe.id for recipe in newest])
+
+    def test_large_author_is_read_on_request(self):
+        with mock.patch('api.feeds.FEED_FAN_OUT_MAX_SUBSCRIBERS', 0):
+            self.publish(1)
+        self.author.refresh_from_db()
+        self.assertTrue(self.author.fan_out_on_read)
+        self.assertEqual(self.feed(), [])
+        response = self.reader_client.get('/api/recipes/feed/')
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_fan_out_resumes(self):
+        with mock.patch('api.feeds.FEED_FAN_OUT_MAX_SUBSCRIBERS', 0):
+            self.publish(1)
+        self.publish(1)
+        self.author.refresh_from_db()
+        self.assertFalse(self.author.fan_out_on_read)
+        self.assertEqual(len(self.feed()), 2)
+
+
+class ReplicaPinningTests(TestCase):
+    """
+    Чтение идет на реплику, пока клиент не записал что-то сам:
+    после записи он REPLICA_PIN_SECONDS читает из основной базы.
+    """
+
+    def setUp(self):
+        cache.clear()
+        for name, value in (
+            ('get_replicas', ['replica_0']),
+            ('choose_replica', 'replica_0'),
+            ('is_shared_cache', True),
+        ):
+            patcher = mock.patch.object(
+                db_routing, name, return_value=value
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+
+    def request(self, method, action=None, credentials='Token first'):
+        databases = []
+
+        def view(request):
+            if action is not None:
+                action()
+            databases.append(router.db_for_read(Tag))
+
+        middleware = db_routing.ReplicaRoutingMiddleware(view)
+        with connection.execute_wrapper(db_routing.track_writes):
+            middleware(getattr(self.factory, method)(
+                '/', HTTP_AUTHORIZATION=credentials
+            ))
+        return databases[0]
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.request('get'), 'replica_0')
+
+    def test_read_after_write_goes_to_primary(self):
+        self.request(
+            'post', lambda: Tag.objects.create(name='new', slug='new')
+        )
+        self.assertEqual(self.request('get'), DEFAULT_DB_ALIAS)
+        self.assertEqual(
+            self.request('get', credentials='Token second'), 'replica_0'
+        )
+
+    def test_pin_expires(self):
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            self.request(
+                'post', lambda: Tag.objects.create(name='new', slug='new')
+            )
+        self.assertEqual(self.request('get'), 'replica_0')
+
+    def test_reads_and_savepoints_do_not_pin(self):
+        def read():
+            with transaction.atomic():
+                list(Tag.objects.using(DEFAULT_DB_ALIAS).all())
+
+        self.assertEqual(self.request('get', read), 'replica_0')
+        self.assertEqual(self.request('get'), 'replica_0')
+
+
+class TokenOnReplicaTests(TestCase):
+    """
+    Реплика еще не получила токен: запрос сразу после входа
+    не должен получать 401.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(
+            email='user@example.com', username='user',
+            password='secret-pass-1', first_name='u', last_name='u',
+        )
+
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.client = APIClient()
+
+    def get_me(self, key):
+        # Поиск токена на реплике ничего не находит.
+        with mock.patch.object(
+            TokenAuthentication, 'authenticate_credentials',
+            side_effect=AuthenticationFailed,
+        ), mock.patch('api.authentication.router') as replica_router:
+            replica_router.db_for_read.return_value = 'replica_0'
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+            return self.client.get('/api/users/me/')
+
+    def test_login_caches_token(self):
+        response = self.client.post('/api/auth/token/login/', {
+            'email': 'user@example.com', 'password': 'secret-pass-1',
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+        with mock.patch.object(
+            CachedTokenAuthentication, 'authenticate_on_primary',
+            side_effect=AuthenticationFailed,
+        ):
+            response = self.get_me(response.json()['auth_token'])
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['id'], self.user.id)
+
+    def test_new_token_is_read_from_primary(self):
+        token = Token.objects.create(user=self.user)
+        response = self.get_me(token.key)
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_old_token_is_not_read_from_primary(self):
+        token = Token.objects.create(user=self.user)
+        Token.objects.filter(pk=token.pk).update(
+            created=timezone.now() - timedelta(hours=1)
+        )
+        response = self.get_me(token.key)
+        self.assertEqual(response.status_code, 401, response.content)
+
+
+class TokenCacheTests(TestCase):
+    """
+    Закешированный токен перестает действовать сразу после выхода
+    и деактивации, а смена пароля убирает из кеша старую копию
+    пользователя.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(
+            email='user@example.com', username='user',
+            password='secret-pass-1', first_name='u', last_name='u',
+        )
+
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.cache_key = get_token_cache_key(self.token.key)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        # Первый запрос кладет пользователя в кеш.
+        self.assertEqual(self.get_me().status_code, 200)
+        self.assertIsNotNone(local_tokens.get(self.cache_key))
+
+    def get_me(self):
+        return self.client.get('/api/users/me/')
+
+    def assertForgotten(self):
+        self.assertIsNone(local_tokens.get(self.cache_key))
+        self.assertIsNone(cache.get(self.cache_key))
+
+    def test_logout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204, response.content)
+        self.assertForgotten()
+        self.assertEqual(self.get_me().status_code, 401)
+
+    def test_password_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/set_password/', {
+                'current_password': 'secret-pass-1',
+                'new_password': 'secret-pass-2',
+            })
+        self.assertEqual(response.status_code, 204, response.content)
+        self.assertForgotten()
+        self.assertEqual(self.get_me().status_code, 200)
+        cached = pickle.loads(local_tokens.get(self.cache_key))
+        self.assertTrue(cached.check_password('secret-pass-2'))
+
+    def test_deactivation(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertForgotten()
+        self.assertEqual(self.get_me().status_code, 401)
@@ -0,0 +1,37 @@
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+
+from .constants import MAX_UPLOAD_SIZE
+
+
+class UploadTooLarge(MultiPartParserError):
+    pass
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Пишет загружаемые файлы сразу во временный файл на диске
+    и прерывает загрузку, как только превышен MAX_UPLOAD_SIZE.
+    """
+    message = (
+        f'Размер файла не должен превышать '
+        f'{MAX_UPLOAD_SIZE // (1024 * 1024)} МБ.'
+    )
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        # Запрос заведомо больше лимита: не читаем тело вовсе.
+        if content_length and content_length > MAX_UPLOAD_SIZE * 2:
+            raise UploadTooLarge(self.message)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > MAX_UPLOAD_SIZE:
+            self.file.close()
+            raise UploadTooLarge(self.message)
+        return super().receive_data_chunk(raw_data, start)
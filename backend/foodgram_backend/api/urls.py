@@ -1,11 +1,19 @@
-from django.urls import include, path
+from django.conf import settings
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
+from rest_framework_simplejwt.views import (
+    TokenBlacklistView,
+    TokenObtainPairView,
+    TokenRefreshView,
+)
 
+from .async_views import async_read_view
 from .views import (
     CustomUserViewSet,
     IngredientViewSet,
     RecipeViewSet,
     TagViewSet,
+    TokenLoginView,
 )
 
 router = DefaultRouter()
@@ -16,5 +24,55 @@ router.register(r'recipes', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
     path('', include(router.urls)),
+    re_path(r'^auth/token/login/?$', TokenLoginView.as_view(), name='login'),
     path('auth/', include('djoser.urls.authtoken')),
 ]
+
+if settings.AUTH_MODE == 'jwt':
+    urlpatterns += [
+        path(
+            'auth/jwt/create/', TokenObtainPairView.as_view(),
+            name='jwt_create',
+        ),
+        path(
+            'auth/jwt/refresh/', TokenRefreshView.as_view(),
+            name='jwt_refresh',
+        ),
+        path(
+            'auth/jwt/logout/', TokenBlacklistView.as_view(),
+            name='jwt_logout',
+        ),
+    ]
+
+if settings.SERVER_MODE == 'asgi':
+    # Горячие маршруты чтения обслуживаются асинхронными обертками
+    # и должны стоять перед маршрутами роутера.
+    urlpatterns = [
+        path('recipes/', async_read_view(RecipeViewSet.as_view(
+            {'get': 'list', 'post': 'create'},
+            basename='recipes', detail=False,
+        ))),
+        path('recipes/<int:pk>/', async_read_view(RecipeViewSet.as_view(
+            {
+                'get': 'retrieve',
+                'put': 'update',
+                'patch': 'partial_update',
+                'delete': 'destroy',
+            },
+            basename='recipes', detail=True,
+        ))),
+        path('ingredients/', async_read_view(IngredientViewSet.as_view(
+            {'get': 'list'}, basename='ingredient', detail=False,
+        ))),
+        path('ingredients/<int:pk>/', async_read_view(
+            IngredientViewSet.as_view(
+                {'get': 'retrieve'}, basename='ingredient', detail=True,
+            )
+        )),
+        path('tags/', async_read_view(TagViewSet.as_view(
+            {'get': 'list'}, basename='tag', detail=False,
+        ))),
+        path('tags/<int:pk>/', async_read_view(TagViewSet.as_view(
+            {'get': 'retrieve'}, basename='tag', detail=True,
+        ))),
+    ] + urlpatterns
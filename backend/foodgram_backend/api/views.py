@@ -1,9 +1,11 @@
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-from hashids import Hashids
 
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from rest_framework.permissions import (
     AllowAny,
     IsAuthenticated,
@@ -11,27 +13,79 @@ from rest_framework.permissions import (
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
-from djoser.views import UserViewSet
+from djoser.views import TokenCreateView, UserViewSet
 
-from users.models import MyUser, Subscription
-from .constants import CUR_BASE_URL, MAX_LEN_SL
+from users.models import JWTUser, MyUser, Subscription
+from . import shortlinks
+from .authentication import remember_token
+from .bulk import add_links, remove_links
+from .constants import (
+    CUR_BASE_URL,
+    LIST_IMAGE_VARIANT,
+    RECOMMENDATIONS_TOP_K,
+)
+from .counters import change_counters
+from .exports import SHOPPING_LIST_FORMATS, shopping_list_response
+from .feeds import add_author_to_feed, remove_authors_from_feed
 from .filters import IngredientFilter, RecipeFilter
-from .models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
-from .pagination import CustomPagination
+from .models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    ShoppingCart,
+    SimilarRecipe,
+    Tag,
+)
+from .negotiation import IgnoreFormatContentNegotiation
+from .pagination import CustomPagination, invalidate_counts
 from .permissions import IsAuthorOrAdminOrReadOnly
 from .serializers import (
     AvatarSerializer,
     CreateRecipeSerializer,
+    IdListSerializer,
     IngredientSerializer,
     PasswordChangeSerializer,
     RecipeSerializer,
+    RecipeShortSerializer,
+    SimilarRecipeSerializer,
     SubscriptionCreateSerializer,
     SubscriptionSerializer,
     TagSerializer,
     UserProfileSerializer,
 )
+from .similarity import find_similar
+
 
-hashids = Hashids(min_length=MAX_LEN_SL, salt="your_secret_salt")
+def get_recipes_limit(request):
+    """
+    Достает из запроса ограничение числа рецептов в превью автора.
+    """
+    limit = request.query_params.get('recipes_limit')
+    if not limit:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValidationError(
+            {'recipes_limit': 'recipes_limit должен быть числом.'}
+        )
+    if limit < 0:
+        raise ValidationError(
+            {'recipes_limit': 'recipes_limit не может быть отрицательным.'}
+        )
+    return limit
+
+
+class TokenLoginView(TokenCreateView):
+    """
+    Вход по токену. Новый токен сразу попадает в кеш токенов:
+    запрос клиента сразу после входа может уйти на реплику,
+    до которой токен еще не дошел.
+    """
+    def _action(self, serializer):
+        response = super()._action(serializer)
+        remember_token(response.data['auth_token'], serializer.user)
+        return response
 
 
 class CustomUserViewSet(UserViewSet):
@@ -42,6 +96,7 @@ class CustomUserViewSet(UserViewSet):
     serializer_class = UserProfileSerializer
     permission_classes = [AllowAny]
     pagination_class = CustomPagination
+    count_strategy = 'cached'
     lookup_field = 'pk'
 
     @action(
@@ -53,9 +108,19 @@ class CustomUserViewSet(UserViewSet):
         """
         Эндпоинт GET /api/users/me/
         Получение данных текущего пользователя.
+        Пользователь из JWT собран по токену без базы, поэтому
+        здесь он читается из базы: удаленный или деактивированный
+        пользователь с живым access-токеном получает 401.
         """
+        user = request.user
+        if isinstance(user, JWTUser):
+            user = MyUser.objects.filter(pk=user.pk, is_active=True).first()
+            if user is None:
+                raise AuthenticationFailed(
+                    'Пользователь не найден или неактивен.'
+                )
         serializer = UserProfileSerializer(
-            request.user, context={'request': request}
+            user, context={'request': request}
         )
         return Response(serializer.data)
 
@@ -86,7 +151,7 @@ class CustomUserViewSet(UserViewSet):
             if user.avatar:
                 user.avatar.delete(save=False)
             user.avatar = None
-            user.save()
+            user.save(update_fields=['avatar'])
             return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -126,33 +191,101 @@ class CustomUserViewSet(UserViewSet):
         }
         if request.method == 'POST':
             serializer = SubscriptionCreateSerializer(
-                data=data, context={'request': request}
+                data=data, context={
+                    'request': request,
+                    'recipes_limit': get_recipes_limit(request),
+                },
             )
-            if serializer.is_valid():
-                serializer.save()
+            if not serializer.is_valid():
                 return Response(
-                    serializer.data,
-                    status=status.HTTP_201_CREATED
+                    serializer.errors,
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                with transaction.atomic():
+                    serializer.save()
+            except IntegrityError:
+                return Response(
+                    {'error': 'Вы уже подписаны на этого пользователя.'},
+                    status=status.HTTP_400_BAD_REQUEST,
                 )
             return Response(
-                serializer.errors,
-                status=status.HTTP_400_BAD_REQUEST
+                serializer.data,
+                status=status.HTTP_201_CREATED
             )
         elif request.method == 'DELETE':
-            subscription = Subscription.objects.filter(
+            deleted, _ = Subscription.objects.filter(
                 subscriber=subscriber, subscribed_to=subscribed_to
-            ).first()
-            if not subscription:
+            ).delete()
+            if not deleted:
                 return Response(
                     {'error': 'Подписка не найдена.'},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            subscription.delete()
             return Response(
                 {'message': 'Подписка успешно удалена.'},
                 status=status.HTTP_204_NO_CONTENT,
             )
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='subscribe',
+    )
+    def subscribe_many(self, request):
+        """
+        Подписаться на нескольких пользователей или отписаться
+        от них: {"ids": [...]}. Повторы и отсутствующие подписки
+        не считаются ошибкой.
+        """
+        serializer = IdListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        subscriber = request.user.pk
+        if request.method == 'DELETE':
+            with transaction.atomic():
+                removed = remove_links(
+                    Subscription, 'subscriber', 'subscribed_to',
+                    subscriber, ids,
+                )
+                change_counters(MyUser, removed, 'subscribers_count', -1)
+                remove_authors_from_feed(subscriber, removed)
+            if removed:
+                invalidate_counts(Subscription)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        if subscriber in ids:
+            raise ValidationError(
+                {'ids': 'Нельзя подписаться на самого себя.'}
+            )
+        missing = set(ids) - set(
+            MyUser.objects.filter(pk__in=ids).values_list('pk', flat=True)
+        )
+        if missing:
+            raise ValidationError({'ids': 'Пользователи не найдены: ' + (
+                ', '.join(map(str, sorted(missing)))
+            )})
+        with transaction.atomic():
+            added = add_links(
+                Subscription, 'subscriber', 'subscribed_to',
+                subscriber, ids, created_at=timezone.now(),
+            )
+            change_counters(MyUser, added, 'subscribers_count', 1)
+            for author in added:
+                add_author_to_feed(subscriber, author)
+        if added:
+            invalidate_counts(Subscription)
+        subscriptions = Subscription.objects.for_subscriber(
+            request.user, get_recipes_limit(request),
+        ).filter(subscribed_to__in=ids)
+        return Response(
+            SubscriptionSerializer(
+                subscriptions, many=True, context={'request': request}
+            ).data,
+            status=status.HTTP_201_CREATED,
+        )
+
     @action(
         detail=False,
         methods=['get'],
@@ -164,9 +297,11 @@ class CustomUserViewSet(UserViewSet):
         Получить список пользователей,
         на которых подписан текущий пользователь.
         """
-        subscriptions = Subscription.objects.filter(subscriber=request.user)
+        subscriptions = Subscription.objects.for_subscriber(
+            request.user, get_recipes_limit(request),
+        )
         paginator = CustomPagination()
-        page = paginator.paginate_queryset(subscriptions, request)
+        page = paginator.paginate_queryset(subscriptions, request, view=self)
         if page is not None:
             serializer = SubscriptionSerializer(
                 page, many=True, context={'request': request}
@@ -207,16 +342,59 @@ class RecipeViewSet(ModelViewSet):
     """
     queryset = Recipe.objects.all()
     pagination_class = CustomPagination
+    count_strategy = 'estimated'
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
-    search_fields = ('^name',)
     permission_classes = [IsAuthorOrAdminOrReadOnly]
+    cursor_pagination = False
+    cursor_fields = ('created_at', 'id')
+
+    def get_queryset(self):
+        """
+        Для чтения подгружает связанные данные и флаги пользователя
+        заранее, чтобы число запросов не зависело от размера страницы.
+        """
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve', 'feed'):
+            return queryset.with_related().with_user_flags(
+                self.request.user
+            )
+        if self.action in ('update', 'partial_update'):
+            return queryset.select_related('author').with_user_flags(
+                self.request.user
+            )
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'feed'):
+            context['image_variant'] = LIST_IMAGE_VARIANT
+        return context
 
     def get_serializer_class(self):
-        if self.action == 'list':
+        if self.action in ('list', 'retrieve', 'feed'):
             return RecipeSerializer
         return CreateRecipeSerializer
 
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated],
+        cursor_pagination=True,
+        cursor_fields=('feed_created_at', 'feed_recipe_id'),
+    )
+    def feed(self, request):
+        """
+        Рецепты авторов, на которых подписан пользователь,
+        от новых к старым. Листается только курсором.
+        """
+        queryset = self.filter_queryset(
+            self.get_queryset().for_feed(request.user)
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(
         detail=True,
         methods=['get'],
@@ -224,13 +402,139 @@ class RecipeViewSet(ModelViewSet):
         url_path='get-link',
     )
     def get_link(self, request, pk=None):
+        """
+        Короткая ссылка на рецепт. Код назначается при создании
+        рецепта, поэтому запрос только читает данные.
+        """
         recipe = self.get_object()
-        if not recipe.short_url:
-            recipe.short_url = hashids.encode(recipe.id)
-            recipe.save()
-        short_link = f'{CUR_BASE_URL}s/{recipe.short_url}'
+        short_url = recipe.short_url or shortlinks.encode(recipe.id)
+        short_link = f'{CUR_BASE_URL}s/{short_url}'
         return Response({'short-link': short_link}, status=status.HTTP_200_OK)
 
+    @action(
+        detail=True,
+        methods=['get'],
+        permission_classes=[AllowAny],
+    )
+    def similar(self, request, pk=None):
+        """
+        Похожие рецепты из таблицы, которую заполняет
+        команда build_recommendations.
+        """
+        recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+        similar = SimilarRecipe.objects.filter(
+            recipe=recipe
+        ).select_related('similar').only(
+            'score', 'similar__id', 'similar__name', 'similar__image',
+            'similar__image_variants', 'similar__cooking_time',
+        ).order_by('-score')[:RECOMMENDATIONS_TOP_K]
+        serializer = SimilarRecipeSerializer(
+            similar, many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=['get'],
+        permission_classes=[AllowAny],
+        url_path='similar-ingredients',
+    )
+    def similar_ingredients(self, request, pk=None):
+        """
+        Рецепты с похожим набором ингредиентов. В отличие от similar
+        не зависит от избранного и работает для новых рецептов.
+        """
+        recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+        scores = dict(find_similar(recipe.pk))
+        recipes = Recipe.objects.filter(pk__in=scores).only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time'
+        ).in_bulk()
+        similar = [
+            SimilarRecipe(
+                recipe=recipe, similar=recipes[similar_id], score=score
+            )
+            for similar_id, score in scores.items() if similar_id in recipes
+        ]
+        serializer = SimilarRecipeSerializer(
+            similar, many=True, context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
+
+    def add_recipe(self, request, pk, model, error):
+        """
+        Добавляет рецепт в избранное или список покупок. Повтор
+        отсекает уникальное ограничение, без проверки заранее.
+        """
+        recipe = get_object_or_404(Recipe, pk=pk)
+        try:
+            with transaction.atomic():
+                model.objects.create(user=request.user, recipe=recipe)
+        except IntegrityError:
+            return Response(
+                {'error': error}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(
+            {
+                'id': recipe.id,
+                'name': recipe.name,
+                'image': recipe.image.url,
+                'cooking_time': recipe.cooking_time,
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+    def remove_recipe(self, request, pk, model, error):
+        recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+        deleted, _ = model.objects.filter(
+            user=request.user, recipe=recipe
+        ).delete()
+        if not deleted:
+            return Response(
+                {'error': error}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def change_recipes(self, request, model, counter):
+        """
+        Пакетное добавление или удаление рецептов {"ids": [...]}:
+        проверка id одним запросом, затем один INSERT или DELETE.
+        Повторы и отсутствующие записи не считаются ошибкой.
+        """
+        serializer = IdListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        if request.method == 'DELETE':
+            with transaction.atomic():
+                removed = remove_links(
+                    model, 'user', 'recipe', request.user.pk, ids
+                )
+                change_counters(Recipe, removed, counter, -1)
+            if removed:
+                invalidate_counts(model)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        recipes = Recipe.objects.filter(pk__in=ids).only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time'
+        ).in_bulk()
+        missing = set(ids) - recipes.keys()
+        if missing:
+            raise ValidationError({'ids': 'Рецепты не найдены: ' + (
+                ', '.join(map(str, sorted(missing)))
+            )})
+        with transaction.atomic():
+            added = add_links(model, 'user', 'recipe', request.user.pk, ids)
+            change_counters(Recipe, added, counter, 1)
+        if added:
+            invalidate_counts(model)
+        return Response(
+            RecipeShortSerializer(
+                [recipes[pk] for pk in ids],
+                many=True,
+                context=self.get_serializer_context(),
+            ).data,
+            status=status.HTTP_201_CREATED,
+        )
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -241,75 +545,52 @@ class RecipeViewSet(ModelViewSet):
         """
         Добавление и удаление рецепта из списка покупок.
         """
-        recipe = get_object_or_404(Recipe, pk=pk)
         if request.method == 'POST':
-            if ShoppingCart.objects.filter(
-                user=request.user,
-                recipe=recipe
-            ).exists():
-                return Response(
-                    {'error': 'Рецепт уже находится в списке покупок.'},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            ShoppingCart.objects.create(user=request.user, recipe=recipe)
-            return Response(
-                {
-                    'id': recipe.id,
-                    'name': recipe.name,
-                    'image': recipe.image.url,
-                    'cooking_time': recipe.cooking_time,
-                },
-                status=status.HTTP_201_CREATED,
+            return self.add_recipe(
+                request, pk, ShoppingCart,
+                'Рецепт уже находится в списке покупок.',
             )
-        elif request.method == 'DELETE':
-            shopping_cart_entry = ShoppingCart.objects.filter(
-                user=request.user, recipe=recipe
-            ).first()
-            if not shopping_cart_entry:
-                return Response(
-                    {'error': 'Рецепта нет в списке покупок.'},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            shopping_cart_entry.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.remove_recipe(
+            request, pk, ShoppingCart,
+            'Рецепта нет в списке покупок.',
+        )
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='shopping_cart',
+    )
+    def shopping_cart_many(self, request):
+        """
+        Добавление и удаление нескольких рецептов из списка покупок.
+        """
+        return self.change_recipes(request, ShoppingCart, 'carts_count')
 
     @action(
         detail=False,
         methods=['get'],
         permission_classes=[IsAuthenticated],
+        content_negotiation_class=IgnoreFormatContentNegotiation,
     )
     def download_shopping_cart(self, request):
         """
-        Скачивание списка покупок.
+        Скачивание списка покупок с суммированием одинаковых
+        ингредиентов. Формат задается параметром format.
         """
-        shopping_cart = ShoppingCart.objects.filter(user=request.user)
-        if not shopping_cart.exists():
+        export_format = request.query_params.get('format', 'txt')
+        if export_format not in SHOPPING_LIST_FORMATS:
+            formats = ', '.join(SHOPPING_LIST_FORMATS)
+            return Response(
+                {'format': f'Доступные форматы: {formats}.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not ShoppingCart.objects.filter(user=request.user).exists():
             return Response(
                 {'detail': 'Ваш список покупок пуст.'},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-
-        content = []
-        for item in shopping_cart:
-            for ingredient in item.recipe.recipe_ingredients.all():
-                content.append(
-                    f'{ingredient.ingredient.name} - '
-                    f'{ingredient.amount} '
-                    f'{ingredient.ingredient.measurement_unit}'
-
-                )
-
-        response = Response(
-            '\n'.join(content),
-            content_type='text/plain',
-            status=status.HTTP_200_OK,
-        )
-        response['Content-Disposition'] = (
-            'attachment; filename='
-            'shopping_cart.txt'
-        )
-
-        return response
+        return shopping_list_response(request.user, export_format)
 
     @action(
         detail=True,
@@ -321,34 +602,24 @@ class RecipeViewSet(ModelViewSet):
         """
         Добавление и удаление рецепта из списка избранного.
         """
-        recipe = get_object_or_404(Recipe, pk=pk)
         if request.method == 'POST':
-            if Favorite.objects.filter(
-                user=request.user,
-                recipe=recipe
-            ).exists():
-                return Response(
-                    {'error': 'Рецепт уже находится в избранном.'},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            Favorite.objects.create(user=request.user, recipe=recipe)
-            return Response(
-                {
-                    'id': recipe.id,
-                    'name': recipe.name,
-                    'image': recipe.image.url,
-                    'cooking_time': recipe.cooking_time,
-                },
-                status=status.HTTP_201_CREATED,
+            return self.add_recipe(
+                request, pk, Favorite,
+                'Рецепт уже находится в избранном.',
             )
-        elif request.method == 'DELETE':
-            favorite_entry = Favorite.objects.filter(
-                user=request.user, recipe=recipe
-            ).first()
-            if not favorite_entry:
-                return Response(
-                    {'error': 'Рецепт отсутствует в избранном.'},
-                    status=status.HTTP_400_BAD_REQUEST,
-                )
-            favorite_entry.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.remove_recipe(
+            request, pk, Favorite,
+            'Рецепт отсутствует в избранном.',
+        )
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='favorite',
+    )
+    def favorite_many(self, request):
+        """
+        Добавление и удаление нескольких рецептов из избранного.
+        """
+        return self.change_recipes(request, Favorite, 'favorites_count')
@@ -9,8 +9,33 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
+from asgiref.sync import ThreadSensitiveContext
 from django.core.asgi import get_asgi_application
+from django.core.signals import request_finished
+from django.db import connections
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram_backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    """
+    Django 3.2 выполняет синхронные представления в одном общем потоке
+    на процесс. Отдельный контекст на запрос дает каждому запросу свой
+    поток, как в более новых версиях Django.
+    """
+    async with ThreadSensitiveContext():
+        await django_application(scope, receive, send)
+
+
+def close_request_connections(**kwargs):
+    """
+    Поток запроса завершается вместе с его контекстом, поэтому
+    его соединения закрываются в конце запроса, несмотря на
+    CONN_MAX_AGE. Постоянными остаются соединения пула чтения.
+    """
+    connections.close_all()
+
+
+request_finished.connect(close_request_connections)
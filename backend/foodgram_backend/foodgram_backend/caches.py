@@ -0,0 +1,11 @@
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_shared_cache(alias=DEFAULT_CACHE_ALIAS):
+    """
+    Виден ли кеш всем процессам. Кеш в памяти процесса
+    (без MEMCACHED_LOCATION) у каждого воркера свой.
+    """
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
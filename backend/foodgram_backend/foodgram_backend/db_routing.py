@@ -0,0 +1,233 @@
+import hashlib
+import random
+import re
+import time
+from contextvars import ContextVar
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .caches import is_shared_cache
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Изменяющие команды. EXPLAIN, WITH ... SELECT, SAVEPOINT и SET
+# из atomic() и оценки количества записью не считаются.
+WRITE_SQL = re.compile(
+    r'\s*(INSERT|UPDATE|DELETE|MERGE|COPY|CREATE|ALTER|DROP|TRUNCATE)\b',
+    re.IGNORECASE,
+)
+
+# Отставание реплики в секундах. Реплика, которая принимает WAL
+# и применила все полученное, не отстает. Иначе (WAL не применен
+# или поток WAL оборван) отставание - возраст последней примененной
+# транзакции; NULL - отставание неизвестно. Без роли pg_read_all_stats
+# статус приемника не виден, тогда достаточно самого процесса.
+REPLICA_LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver
+            WHERE COALESCE(status, 'streaming') = 'streaming'
+        ) AND pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn()
+        THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+'''
+
+routing_state = ContextVar('routing_state', default=None)
+
+
+def get_replicas():
+    return [alias for alias in settings.DATABASES if alias.startswith(
+        settings.REPLICA_ALIAS_PREFIX
+    )]
+
+
+class RoutingState:
+    """
+    Состояние маршрутизации одного запроса: можно ли читать с реплики,
+    какая реплика выбрана и были ли записи.
+    """
+    def __init__(self, read_replica):
+        self.read_replica = read_replica
+        self.replica = None
+        self.wrote = False
+
+
+class ReplicaHealth:
+    """
+    Проверка реплик в процессе: доступность и отставание проверяются
+    не чаще раза в REPLICA_HEALTH_INTERVAL секунд на реплику.
+    """
+    def __init__(self):
+        self.checked = {}
+        self.lock = Lock()
+
+    def probe(self, alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor != 'postgresql':
+                    cursor.execute('SELECT 1')
+                    return True
+                cursor.execute(REPLICA_LAG_SQL)
+                lag = cursor.fetchone()[0]
+                return lag is not None and lag <= settings.REPLICA_MAX_LAG
+        except DatabaseError:
+            try:
+                connection.close()
+            except DatabaseError:
+                pass
+            return False
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self.lock:
+            healthy, expires = self.checked.get(alias, (False, 0))
+        if expires > now:
+            return healthy
+        healthy = self.probe(alias)
+        with self.lock:
+            self.checked[alias] = (
+                healthy, now + settings.REPLICA_HEALTH_INTERVAL
+            )
+        return healthy
+
+    def clear(self):
+        with self.lock:
+            self.checked.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+def choose_replica():
+    healthy = [
+        alias for alias in get_replicas() if replica_health.is_healthy(alias)
+    ]
+    return random.choice(healthy) if healthy else DEFAULT_DB_ALIAS
+
+
+def get_pin_key(request):
+    """
+    Ключ закрепления за основной базой по учетным данным клиента:
+    пользователь еще не известен, пока DRF не проверил токен.
+    """
+    credentials = request.META.get('HTTP_AUTHORIZATION') or (
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+    digest = hashlib.sha256(credentials.encode()).hexdigest()
+    return f'db_pin:{digest}'
+
+
+def track_writes(execute, sql, params, many, context):
+    """
+    Отмечает в состоянии запроса изменяющий SQL к основной базе:
+    после записи запрос читает свои данные оттуда же.
+    """
+    state = routing_state.get()
+    if state is not None and WRITE_SQL.match(sql):
+        state.read_replica = False
+        state.wrote = True
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def watch_primary_writes(sender, connection, **kwargs):
+    if connection.alias == DEFAULT_DB_ALIAS and (
+        track_writes not in connection.execute_wrappers
+    ):
+        connection.execute_wrappers.append(track_writes)
+
+
+class ReplicaRouter:
+    """
+    Чтение в безопасных запросах идет на реплику, все остальное -
+    в основную базу. Вне запросов (команды, фоновые потоки) реплики
+    не используются.
+    """
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if state is None or not state.read_replica:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = choose_replica()
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        # Django спрашивает базу для записи и при простом присваивании
+        # связанного объекта, поэтому записи отслеживает track_writes.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def check_connections():
+    """
+    В Django 3.2 нет CONN_HEALTH_CHECKS: постоянное соединение,
+    оборванное между запросами (перезапуск реплики или основной
+    базы), сломало бы первый запрос. Открытые соединения проверяются
+    не чаще раза в REPLICA_HEALTH_INTERVAL секунд, оборванные
+    закрываются и открываются заново при следующем обращении.
+    """
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+        checked = getattr(connection, 'health_checked_at', None)
+        if checked is not None and (
+            now - checked < settings.REPLICA_HEALTH_INTERVAL
+        ):
+            continue
+        connection.health_checked_at = now
+        if not connection.is_usable():
+            connection.close()
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Выбирает базу для запроса. Клиент, который только что писал,
+    REPLICA_PIN_SECONDS читает из основной базы, чтобы видеть свои
+    изменения, пока реплика их догоняет. Закрепление хранится в общем
+    кеше, чтобы действовать во всех воркерах.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if get_replicas() and not is_shared_cache():
+            raise ImproperlyConfigured(
+                'Для реплик нужен общий кеш (MEMCACHED_LOCATION): '
+                'иначе закрепление за основной базой после записи '
+                'действует только в одном воркере.'
+            )
+
+    def __call__(self, request):
+        if not get_replicas():
+            return self.get_response(request)
+
+        check_connections()
+        pin_key = get_pin_key(request)
+        safe = request.method in SAFE_METHODS
+        state = RoutingState(
+            read_replica=safe and not (pin_key and cache.get(pin_key))
+        )
+        state.wrote = not safe
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        if state.wrote and pin_key:
+            cache.set(pin_key, True, settings.REPLICA_PIN_SECONDS)
+        return response
@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -34,6 +35,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'rest_framework.authtoken',
     'django_filters',
     'rest_framework',
@@ -41,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram_backend.db_routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,6 +84,10 @@ WSGI_APPLICATION = 'foodgram_backend.wsgi.application'
 #     }
 # }
 
+# wsgi - синхронные воркеры gunicorn, asgi - воркеры uvicorn
+# с асинхронными представлениями для горячих маршрутов чтения.
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -89,9 +96,62 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
         'PORT': os.getenv('DB_PORT', 5432),
+        # Под ASGI постоянные соединения держат потоки пула чтения
+        # (ASYNC_READ_WORKERS), соединения потока запроса закрываются.
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),
     }
 }
 
+# Реплики только для чтения: POSTGRES_REPLICA_HOSTS=host1:5432,host2.
+# База, пользователь и пароль те же, что у основной.
+REPLICA_ALIAS_PREFIX = 'replica_'
+for number, address in enumerate(filter(
+    None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',')
+)):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'{REPLICA_ALIAS_PREFIX}{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'OPTIONS': {
+            'connect_timeout': int(os.getenv('REPLICA_CONNECT_TIMEOUT', 2)),
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['foodgram_backend.db_routing.ReplicaRouter']
+# Сколько секунд после записи клиент читает из основной базы.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
+# Допустимое отставание реплики в секундах и период ее проверки.
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))
+REPLICA_HEALTH_INTERVAL = int(os.getenv('REPLICA_HEALTH_INTERVAL', 10))
+
+# Общий для всех воркеров кеш: токены, количества для пагинации,
+# закрепление клиента за основной базой. MEMCACHED_LOCATION=host:port
+# (несколько серверов - через запятую). Без него у каждого процесса
+# свой кеш в памяти, что годится только для разработки.
+MEMCACHED_LOCATION = os.getenv('MEMCACHED_LOCATION', '')
+if MEMCACHED_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': (
+                'django.core.cache.backends.memcached.PyMemcacheCache'
+            ),
+            'LOCATION': MEMCACHED_LOCATION.split(','),
+            'OPTIONS': {
+                'connect_timeout': 1,
+                'timeout': 1,
+                'no_delay': True,
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -135,6 +195,20 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Файлы из multipart/form-data сразу пишутся на диск, размер
+# ограничивается во время загрузки.
+FILE_UPLOAD_HANDLERS = [
+    'api.uploads.LimitedTemporaryFileUploadHandler',
+]
+
+# Число потоков для нарезки изображений рецептов; 0 - обработка
+# синхронно, сразу после сохранения рецепта.
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+# Размер пула потоков, в котором асинхронные представления
+# выполняют запросы к базе; столько же соединений с базой на процесс.
+ASYNC_READ_WORKERS = int(os.getenv('ASYNC_READ_WORKERS', 8))
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -143,16 +217,36 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.MyUser'
 
+# token - только токены из базы (auth/token/), jwt - еще и JWT
+# (auth/jwt/) с проверкой access-токена без обращения к базе.
+AUTH_MODE = os.getenv('AUTH_MODE', 'token')
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
-    'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-    ],
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        ['api.authentication.StatelessJWTAuthentication']
+        if AUTH_MODE == 'jwt' else []
+    ) + ['api.authentication.CachedTokenAuthentication'],
     'EXCEPTION_HANDLER': 'api.permissions.custom_exception_handler',
 }
 
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(
+        minutes=int(os.getenv('JWT_ACCESS_MINUTES', 5))
+    ),
+    'REFRESH_TOKEN_LIFETIME': timedelta(
+        days=int(os.getenv('JWT_REFRESH_DAYS', 7))
+    ),
+    'ROTATE_REFRESH_TOKENS': True,
+    'BLACKLIST_AFTER_ROTATION': True,
+    'UPDATE_LAST_LOGIN': False,
+    'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_OBTAIN_SERIALIZER': 'api.serializers.JWTObtainSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.JWTRefreshSerializer',
+}
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
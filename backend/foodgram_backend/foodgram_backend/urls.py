@@ -3,14 +3,15 @@ from django.urls import include, path
 from django.conf import settings
 from django.conf.urls.static import static
 
-from .views import redirect_to_recipe
+from .views import redirect_to_recipe, redirect_to_recipe_async
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
     path(
         's/<str:short_url>/',
-        redirect_to_recipe,
+        redirect_to_recipe_async
+        if settings.SERVER_MODE == 'asgi' else redirect_to_recipe,
         name='short_url_redirect'
     ),
 ]
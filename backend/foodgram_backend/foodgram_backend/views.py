@@ -1,8 +1,40 @@
-from django.shortcuts import get_object_or_404, redirect
-from api.constants import CUR_BASE_URL
-from api.models import Recipe
+from django.http import Http404, HttpResponseNotAllowed
+from django.shortcuts import redirect
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_safe
 
+from api.async_views import SAFE_METHODS, run_read
+from api.constants import CUR_BASE_URL, SHORT_URL_REDIRECT_MAX_AGE
+from api.shortlinks import resolve, resolve_cached
 
+
+def short_url_response(recipe_id):
+    if recipe_id is None:
+        raise Http404('Рецепт не найден.')
+    response = redirect(f'{CUR_BASE_URL}recipes/{recipe_id}')
+    patch_cache_control(
+        response, public=True, max_age=SHORT_URL_REDIRECT_MAX_AGE
+    )
+    return response
+
+
+@require_safe
 def redirect_to_recipe(request, short_url):
-    recipe = get_object_or_404(Recipe, short_url=short_url)
-    return redirect(f'{CUR_BASE_URL}recipes/{recipe.pk}')
+    """
+    Перенаправляет по короткой ссылке без обращения к базе для уже
+    известных кодов. Ответ может кешироваться прокси.
+    """
+    return short_url_response(resolve(short_url))
+
+
+async def redirect_to_recipe_async(request, short_url):
+    """
+    То же для ASGI: известные коды разрешаются прямо в цикле
+    событий, за базой идем в пул чтения только для новых.
+    """
+    if request.method not in SAFE_METHODS:
+        return HttpResponseNotAllowed(SAFE_METHODS)
+    found, recipe_id = resolve_cached(short_url)
+    if not found:
+        recipe_id = await run_read(resolve, short_url)
+    return short_url_response(recipe_id)
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_subscription_feed_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='myuser',
+            name='fan_out_on_read',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.16 on 2026-10-17 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_myuser_fan_out_on_read'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='myuser',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='myuser',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.16 on 2026-10-17 12:00
+
+import django.contrib.auth.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_myuser_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JWTUser',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('users.myuser',),
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+    ]
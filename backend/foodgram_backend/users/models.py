@@ -1,14 +1,61 @@
+from django.apps import apps
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import F
+from django.db.models.expressions import RawSQL
 from django.conf import settings
 
+RECIPE_PREVIEWS_SQL = '''
+    SELECT id FROM (
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY author_id ORDER BY id DESC
+        ) AS row_number
+        FROM {recipe_table}
+        WHERE author_id IN (
+            SELECT subscribed_to_id FROM {subscription_table}
+            WHERE subscriber_id = %s
+        )
+    ) AS ranked
+    WHERE row_number <= %s
+'''
 
-class MyUser(AbstractUser):
+
+class CounterFieldsMixin:
+    """
+    Поля из counter_fields меняются только UPDATE с F()-выражениями.
+    Полное сохранение загруженного объекта их не записывает, чтобы
+    не вернуть значения, устаревшие с момента загрузки.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if kwargs.get('update_fields') is None and not self._state.adding:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class MyUser(CounterFieldsMixin, AbstractUser):
     avatar = models.ImageField(
         upload_to='users/images/',
         null=True,
         default=None,
     )
+    # Рецепты авторов с очень большим числом подписчиков не раскладываются
+    # по лентам при публикации, а подмешиваются в ленту при чтении.
+    fan_out_on_read = models.BooleanField(default=False)
+    # Счетчики обновляются вместе с рецептами и подписками,
+    # пересчитываются командой rebuild_counters.
+    recipes_count = models.PositiveIntegerField(default=0, editable=False)
+    subscribers_count = models.PositiveIntegerField(
+        default=0, editable=False
+    )
+    counter_fields = ('recipes_count', 'subscribers_count')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name', 'password')
@@ -22,6 +69,66 @@ class MyUser(AbstractUser):
         ]
 
 
+class JWTUser(MyUser):
+    """
+    Пользователь из access-токена JWT. Из claims известны только id
+    и is_staff, поэтому фильтры и проверки прав обходятся без базы;
+    остальные поля дочитываются одним запросом при первом обращении.
+    """
+    class Meta:
+        proxy = True
+
+    @classmethod
+    def from_token(cls, user_id, is_staff):
+        return cls.from_db(
+            None, ['id', 'is_staff', 'is_active'], [user_id, is_staff, True]
+        )
+
+    def refresh_from_db(self, using=None, fields=None):
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred.issuperset(fields):
+            fields = deferred
+        super().refresh_from_db(using, fields)
+
+
+class SubscriptionQuerySet(models.QuerySet):
+    """
+    Набор запросов подписок для страницы подписок.
+    """
+
+    def for_subscriber(self, user, recipes_limit=None):
+        """
+        Подписки пользователя с данными автора, счетчиком его рецептов
+        и превью последних рецептов. Превью ограничиваются на стороне
+        БД оконной функцией и загружаются одним запросом для всей
+        страницы.
+        """
+        recipe_model = apps.get_model('api', 'Recipe')
+        recipes = recipe_model.objects.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time',
+            'author_id',
+        ).order_by('-id')
+        if recipes_limit is not None:
+            recipes = recipes.filter(pk__in=RawSQL(
+                RECIPE_PREVIEWS_SQL.format(
+                    recipe_table=recipe_model._meta.db_table,
+                    subscription_table=self.model._meta.db_table,
+                ),
+                (user.pk, recipes_limit),
+            ))
+        return self.filter(subscriber=user).select_related(
+            'subscribed_to'
+        ).annotate(
+            recipes_count=F('subscribed_to__recipes_count'),
+        ).prefetch_related(
+            models.Prefetch(
+                'subscribed_to__recipes',
+                queryset=recipes,
+                to_attr='recipe_previews',
+            )
+        ).order_by('-created_at', '-id')
+
+
 class Subscription(models.Model):
     subscriber = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -35,8 +142,16 @@ class Subscription(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = SubscriptionQuerySet.as_manager()
+
     class Meta:
         unique_together = ('subscriber', 'subscribed_to')
+        indexes = [
+            models.Index(
+                fields=['subscriber', '-created_at', '-id'],
+                name='subscription_feed_idx',
+            ),
+        ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
 